@@ -1,14 +1,86 @@
-from flask import Flask
+import os
+import time
+import uuid
+
+from flask import Flask, jsonify, request
 from redis import Redis
 
 app = Flask(__name__)
-redis = Redis(host='redis', port=6379)
+redis = Redis(host=os.environ.get('REDIS_HOST', 'redis'), port=int(os.environ.get('REDIS_PORT', 6379)))
+
+VISITOR_COOKIE = 'visitor_id'
+
+# Rolling windows: bucket size in seconds, buckets shown by /stats, and how
+# long a bucket key lives before Redis expires it
+MINUTE = 60
+HOUR = 3600
+MINUTE_BUCKETS = 60
+HOUR_BUCKETS = 24
+MINUTE_TTL = 2 * HOUR
+HOUR_TTL = 2 * 24 * HOUR
+
+
+def visitor_id():
+    """Visitor identity: a long-lived cookie, assigned on the first visit"""
+    return request.cookies.get(VISITOR_COOKIE) or str(uuid.uuid4())
+
+
+def bucket(now, size):
+    return int(now // size) * size
+
 
 @app.route('/')
 def hello():
-    redis.incr('hits')
-    counter = str(redis.get('hits'),'utf-8')
-    return "This webpage has been viewed "+counter+" time(s)"
+    visitor = visitor_id()
+    now = time.time()
+    minute_key = f'hits:minute:{bucket(now, MINUTE)}'
+    hour_key = f'hits:hour:{bucket(now, HOUR)}'
+    visitors_hour_key = f'visitors:hour:{bucket(now, HOUR)}'
+
+    # One round trip: total, unique visitors (HyperLogLog, ~12 KB however
+    # many visitors) and the rolling counters, which expire on their own
+    pipe = redis.pipeline(transaction=False)
+    pipe.incr('hits')
+    pipe.pfadd('visitors', visitor)
+    pipe.incr(minute_key)
+    pipe.expire(minute_key, MINUTE_TTL)
+    pipe.incr(hour_key)
+    pipe.expire(hour_key, HOUR_TTL)
+    pipe.pfadd(visitors_hour_key, visitor)
+    pipe.expire(visitors_hour_key, HOUR_TTL)
+    counter = pipe.execute()[0]
+
+    response = app.make_response("This webpage has been viewed " + str(counter) + " time(s)")
+    if VISITOR_COOKIE not in request.cookies:
+        response.set_cookie(VISITOR_COOKIE, visitor, max_age=365 * 24 * HOUR, httponly=True)
+    return response
+
+
+@app.route('/stats')
+def stats():
+    now = time.time()
+    minutes = [bucket(now, MINUTE) - i * MINUTE for i in range(MINUTE_BUCKETS)]
+    hours = [bucket(now, HOUR) - i * HOUR for i in range(HOUR_BUCKETS)]
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.get('hits')
+    pipe.pfcount('visitors')
+    pipe.pfcount(f'visitors:hour:{hours[0]}')
+    pipe.mget([f'hits:minute:{ts}' for ts in minutes])
+    pipe.mget([f'hits:hour:{ts}' for ts in hours])
+    hits, unique, unique_hour, per_minute, per_hour = pipe.execute()
+
+    return jsonify({
+        'hits': int(hits or 0),
+        'unique_visitors': unique,
+        'unique_visitors_this_hour': unique_hour,
+        # Newest bucket first; buckets are keyed by their start (epoch seconds)
+        'per_minute': [{'start': ts, 'hits': int(count or 0)} for ts, count in zip(minutes, per_minute)],
+        'per_hour': [{'start': ts, 'hits': int(count or 0)} for ts, count in zip(hours, per_hour)],
+        'hits_last_minute': int(per_minute[0] or 0),
+        'hits_last_hour': sum(int(count or 0) for count in per_minute),
+    })
+
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,77 @@
+"""
+Benchmark: Redis memory per million unique visitors, HyperLogLog vs a set
+
+Adds N random visitor ids (UUIDs, like the app's visitor cookie) to a
+HyperLogLog with PFADD and to a plain set with SADD, in pipelined batches,
+then reports each key's MEMORY USAGE, the memory per million visitors and
+the HyperLogLog's counting error.
+
+Usage:
+    python benchmarks/visitor_memory.py [--visitors 1000000] [--host localhost]
+"""
+import json
+import time
+import uuid
+import argparse
+
+from redis import Redis
+
+HLL_KEY = 'bench:visitors:hll'
+SET_KEY = 'bench:visitors:set'
+
+
+def fill(redis, visitors, batch):
+    """Add the same visitor ids to both keys; return seconds spent per key type"""
+    elapsed = {'hll': 0.0, 'set': 0.0}
+    for start in range(0, visitors, batch):
+        ids = [str(uuid.uuid4()) for _ in range(min(batch, visitors - start))]
+        for kind, command, key in (('hll', 'pfadd', HLL_KEY), ('set', 'sadd', SET_KEY)):
+            started = time.perf_counter()
+            pipe = redis.pipeline(transaction=False)
+            for i in range(0, len(ids), 1000):
+                getattr(pipe, command)(key, *ids[i:i + 1000])
+            pipe.execute()
+            elapsed[kind] += time.perf_counter() - started
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--visitors', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=50000)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+
+    redis = Redis(host=args.host, port=args.port)
+    redis.delete(HLL_KEY, SET_KEY)
+    try:
+        elapsed = fill(redis, args.visitors, args.batch)
+        per_million = 1000000 / args.visitors
+        hll_bytes = redis.memory_usage(HLL_KEY, samples=0)
+        set_bytes = redis.memory_usage(SET_KEY, samples=0)
+        estimate = redis.pfcount(HLL_KEY)
+        print(json.dumps({
+            'visitors': args.visitors,
+            'hyperloglog': {
+                'bytes': hll_bytes,
+                # Fixed size: does not grow with the number of visitors
+                'bytes_per_million_visitors': hll_bytes,
+                'estimate': estimate,
+                'error_pct': round(abs(estimate - args.visitors) / args.visitors * 100, 3),
+                'add_seconds': round(elapsed['hll'], 2),
+            },
+            'set': {
+                'bytes': set_bytes,
+                'bytes_per_million_visitors': round(set_bytes * per_million),
+                'count': redis.scard(SET_KEY),
+                'add_seconds': round(elapsed['set'], 2),
+            },
+            'set_to_hll_ratio': round(set_bytes / hll_bytes, 1),
+        }, indent=2))
+    finally:
+        redis.delete(HLL_KEY, SET_KEY)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+"""
+Admission control module: Rate limiting and load shedding for the API
+
+Every API request passes three checks before it reaches a route:
+
+1. Token-bucket rate limits per client and per route class (read/write)
+2. A concurrency limit per endpoint with a short bounded wait queue, so
+   slow writes cannot take every worker thread away from cheap reads
+3. A queue-wait budget: a request that has already waited too long (in the
+   proxy/gunicorn queue or for an endpoint slot) gets an early 503 with
+   Retry-After instead of timing out after doing the work anyway
+
+Rate-limit state is per process, or shared through Redis when REDIS_URL is
+set; if the limiter fails (Redis down), requests are admitted. Concurrency
+limits are always per process, so they need threaded workers (gthread, the
+shipped default) to have any effect.
+
+init_admission installs the checks on the Flask app, init_async_admission on
+the Quart app of the ASGI mode.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from flask import request, g
+
+import metrics
+from redis_utils import get_redis
+
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# Endpoints that must stay reachable while the service is shedding load
+EXEMPT_ENDPOINTS = {'static', 'serve_asset', 'get_metrics', 'healthz', 'readyz'}
+
+
+def get_admission_config():
+    """Get admission control configuration from environment variables"""
+    return {
+        'enabled': os.environ.get('ADMISSION_ENABLED', '1') == '1',
+        'client_rates': {
+            'read': float(os.environ.get('ADMISSION_CLIENT_READ_RATE', 100)),
+            'write': float(os.environ.get('ADMISSION_CLIENT_WRITE_RATE', 20)),
+        },
+        'class_rates': {
+            'read': float(os.environ.get('ADMISSION_READ_RATE', 2000)),
+            'write': float(os.environ.get('ADMISSION_WRITE_RATE', 200)),
+        },
+        'burst': float(os.environ.get('ADMISSION_BURST', 2.0)),
+        'max_concurrency': {
+            'read': int(os.environ.get('ADMISSION_READ_CONCURRENCY', 32)),
+            'write': int(os.environ.get('ADMISSION_WRITE_CONCURRENCY', 8)),
+        },
+        'max_queue': {
+            'read': int(os.environ.get('ADMISSION_READ_QUEUE', 32)),
+            'write': int(os.environ.get('ADMISSION_WRITE_QUEUE', 4)),
+        },
+        'queue_budget': float(os.environ.get('ADMISSION_QUEUE_BUDGET', 0.5)),
+    }
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, tokens=1):
+        """Take tokens; return 0 on success or the seconds until they are available"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+
+class LocalRateLimiter:
+    """Per-process token buckets, LRU-bounded so unique clients cannot grow it forever"""
+
+    def __init__(self, max_buckets=10000):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        """Take one token from the bucket for key; return the retry delay (0 if allowed)"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, capacity)
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        return bucket.take()
+
+
+class ConcurrencyLimiter:
+    """
+    Limits in-flight requests for one endpoint
+
+    Up to `max_queue` requests may wait for a slot; anything beyond that is
+    rejected immediately, because a waiting request still holds a worker
+    thread that a cheap read could have used.
+    """
+
+    def __init__(self, limit, max_queue):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        """Take a slot, waiting at most `timeout` seconds; return False if shed"""
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            if self.waiting >= self.max_queue or timeout <= 0:
+                return False
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.limit, timeout)
+            finally:
+                self.waiting -= 1
+            if admitted:
+                self.active += 1
+            return admitted
+
+    def release(self):
+        """Give a slot back and wake one waiter"""
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class AsyncConcurrencyLimiter:
+    """ConcurrencyLimiter for the ASGI mode: waiting requests yield the event loop"""
+
+    def __init__(self, limit, max_queue):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, timeout):
+        """Take a slot, waiting at most `timeout` seconds; return False if shed"""
+        async with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            if self.waiting >= self.max_queue or timeout <= 0:
+                return False
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self.active < self.limit), timeout)
+                admitted = True
+            except asyncio.TimeoutError:
+                admitted = False
+            finally:
+                self.waiting -= 1
+            if admitted:
+                self.active += 1
+            return admitted
+
+    async def release(self):
+        """Give a slot back and wake one waiter"""
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+# Refill and take atomically on the Redis server.
+# KEYS[1] = bucket key; ARGV = rate, capacity, now (seconds)
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter:
+    """Token buckets shared by every worker and replica through Redis"""
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, rate, capacity):
+        """Take one token from the shared bucket for key; return the retry delay"""
+        return float(self._script(keys=[self.prefix + key], args=[rate, capacity, time.time()]))
+
+
+def get_route_class(req):
+    """Classify a request as a 'read' or a 'write'"""
+    return 'read' if req.method in READ_METHODS else 'write'
+
+
+def get_client_id(req):
+    """Identify the calling client (first X-Forwarded-For hop behind the ingress)"""
+    forwarded = req.headers.get('X-Forwarded-For')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return req.remote_addr or 'unknown'
+
+
+def get_upstream_queue_wait(req):
+    """
+    Seconds the request spent queued before reaching the app
+
+    Uses the X-Request-Start header set by the proxy (``t=<epoch>`` in
+    seconds, milliseconds or microseconds); 0 when it is absent.
+    """
+    header = req.headers.get('X-Request-Start', '')
+    try:
+        started = float(header.replace('t=', ''))
+    except ValueError:
+        return 0.0
+    # Normalise microseconds / milliseconds to seconds
+    while started > 1e11:
+        started /= 1000.0
+    return max(0.0, time.time() - started)
+
+
+def _reject(status, reason, retry_after, message):
+    """Rejection response; a (body, status, headers) tuple both Flask and Quart accept"""
+    metrics.inc('admission_rejected_total', reason=reason)
+    return ({
+        'success': False,
+        'error': message
+    }, status, {'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+def _rate_limit(limiter, config, client_id, route_class):
+    """Take a token from the client and route-class buckets; return the retry delay (0 if admitted)"""
+    burst = config['burst']
+    for key, rate in (
+        (f'client:{client_id}:{route_class}', config['client_rates'][route_class]),
+        (f'class:{route_class}', config['class_rates'][route_class]),
+    ):
+        try:
+            retry_after = limiter.take(key, rate, rate * burst)
+        except Exception as e:
+            # Fail open: a limiter outage must not take the API down with it
+            logging.error(f"Rate limiter error, admitting request: {e}")
+            metrics.inc('admission_limiter_errors_total')
+            return 0.0
+        if retry_after > 0:
+            return retry_after
+    return 0.0
+
+
+def _endpoint_limiters(config, limiter_class):
+    """Lazily created concurrency limiter per endpoint"""
+    limiters = {}
+    limiters_lock = threading.Lock()
+
+    def endpoint_limiter(endpoint, route_class):
+        with limiters_lock:
+            limiter_ = limiters.get(endpoint)
+            if limiter_ is None:
+                limiter_ = limiters[endpoint] = limiter_class(
+                    config['max_concurrency'][route_class], config['max_queue'][route_class])
+            return limiter_
+    return endpoint_limiter
+
+
+def init_admission(app):
+    """Install admission control hooks on the Flask app"""
+    config = get_admission_config()
+    if not config['enabled']:
+        logging.info("Admission control disabled")
+        return
+
+    client = get_redis()
+    limiter = RedisRateLimiter(client) if client is not None else LocalRateLimiter()
+    endpoint_limiter = _endpoint_limiters(config, ConcurrencyLimiter)
+
+    @app.before_request
+    def admit_request():
+        endpoint = request.endpoint
+        if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        budget = config['queue_budget']
+        upstream_wait = get_upstream_queue_wait(request)
+        if upstream_wait > budget:
+            return _reject(503, 'queue_budget', budget,
+                           'Service is overloaded, please retry later')
+
+        route_class = get_route_class(request)
+        retry_after = _rate_limit(limiter, config, get_client_id(request), route_class)
+        if retry_after > 0:
+            return _reject(429, 'rate_limit', retry_after, 'Rate limit exceeded')
+
+        concurrency = endpoint_limiter(endpoint, route_class)
+        started = time.monotonic()
+        if not concurrency.acquire(timeout=budget - upstream_wait):
+            return _reject(503, 'concurrency', budget,
+                           'Service is overloaded, please retry later')
+        metrics.observe('admission_queue_wait_seconds', time.monotonic() - started,
+                        route_class=route_class)
+        metrics.inc('admission_admitted_total', route_class=route_class)
+        g.admission_limiter = concurrency
+        return None
+
+    @app.teardown_request
+    def release_request(exc=None):
+        concurrency = g.pop('admission_limiter', None)
+        if concurrency is not None:
+            concurrency.release()
+
+
+def init_async_admission(app):
+    """Install admission control hooks on the Quart app (ASGI mode)"""
+    from quart import request as quart_request, g as quart_g
+
+    config = get_admission_config()
+    if not config['enabled']:
+        logging.info("Admission control disabled")
+        return
+
+    client = get_redis()
+    limiter = RedisRateLimiter(client) if client is not None else LocalRateLimiter()
+    endpoint_limiter = _endpoint_limiters(config, AsyncConcurrencyLimiter)
+
+    @app.before_request
+    async def admit_request():
+        endpoint = quart_request.endpoint
+        if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        budget = config['queue_budget']
+        upstream_wait = get_upstream_queue_wait(quart_request)
+        if upstream_wait > budget:
+            return _reject(503, 'queue_budget', budget,
+                           'Service is overloaded, please retry later')
+
+        route_class = get_route_class(quart_request)
+        client_id = get_client_id(quart_request)
+        if isinstance(limiter, RedisRateLimiter):
+            # A Redis round trip would block the event loop
+            retry_after = await asyncio.to_thread(_rate_limit, limiter, config, client_id, route_class)
+        else:
+            retry_after = _rate_limit(limiter, config, client_id, route_class)
+        if retry_after > 0:
+            return _reject(429, 'rate_limit', retry_after, 'Rate limit exceeded')
+
+        concurrency = endpoint_limiter(endpoint, route_class)
+        started = time.monotonic()
+        if not await concurrency.acquire(timeout=budget - upstream_wait):
+            return _reject(503, 'concurrency', budget,
+                           'Service is overloaded, please retry later')
+        metrics.observe('admission_queue_wait_seconds', time.monotonic() - started,
+                        route_class=route_class)
+        metrics.inc('admission_admitted_total', route_class=route_class)
+        quart_g.admission_limiter = concurrency
+        return None
+
+    @app.teardown_request
+    async def release_request(exc=None):
+        concurrency = quart_g.pop('admission_limiter', None)
+        if concurrency is not None:
+            await concurrency.release()
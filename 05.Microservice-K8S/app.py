@@ -16,6 +16,28 @@ app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 # Import routes after app is created to avoid circular imports
 from routes import *
 
+# Rate limiting and load shedding in front of the routes
+from admission import init_admission
+init_admission(app)
+
+# gzip/brotli responses and fingerprinted static assets
+from compression import init_compression
+from assets import init_assets
+init_compression(app)
+init_assets(app)
+
+# Background workers for asynchronous order intake
+from order_intake import init_order_intake
+init_order_intake(app)
+
+# Per-request database query accounting (db_utils cursors report to it)
+from query_stats import init_query_stats
+init_query_stats(app)
+
+# Health endpoints and startup warmup
+from warmup import init_warmup
+init_warmup(app)
+
 # Note: For MVP we're using in-memory storage
 # In the future, we'll implement PostgreSQL integration
 # app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
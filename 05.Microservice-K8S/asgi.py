@@ -0,0 +1,315 @@
+"""
+ASGI application: asyncio serving mode for the microservice API
+
+Serves the same REST API as routes.py from a Quart app, on the same models
+layer and the same request handlers (handlers.py). Handlers are coroutines, so a worker can keep many requests in
+flight while they wait on I/O (PostgreSQL through async_db_utils) instead of
+holding a thread each. The order event stream is an async generator and
+holds no thread at all.
+
+The models, cache, event and idempotency code talk to Redis with the
+blocking client; with REDIS_URL set those calls run in a thread
+(call_models, aidempotent) so they never stall the event loop.
+
+Admission control and idempotency keys work as in the WSGI mode. Response
+compression and fingerprinted assets are WSGI-only; put compression in the
+ingress when serving this mode.
+
+Selected at startup with SERVER_MODE=asgi (see main.py and gunicorn.conf.py).
+"""
+import os
+import asyncio
+import hashlib
+import logging
+
+from quart import Quart, request, jsonify, render_template, url_for, Response
+
+import metrics
+import handlers
+from models import User, Product, Order
+from events import get_broadcaster, astream_events
+from fieldsets import parse_fieldset, serialize_many
+from export import EXPORT_FORMATS, OrderExporter, aiter_order_rows, astream_export
+from warmup import is_ready, run_warmup
+from admission import init_async_admission
+from idempotency import aidempotent
+from redis_utils import get_redis
+from order_intake import get_order_intake, get_intake_config, is_async_request
+
+logging.basicConfig(level=logging.DEBUG)
+
+app = Quart(__name__)
+app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+
+
+@app.template_global()
+def asset_url(filename):
+    """Static asset URL (fingerprinted assets are served by the WSGI mode only)"""
+    return url_for('static', filename=filename)
+
+
+@app.before_serving
+async def startup():
+    """Warm up, and start the order workers so jobs queued before a restart get processed"""
+    if get_intake_config()['mode'] != 'sync':
+        await asyncio.to_thread(get_order_intake)
+    if os.environ.get('PGHOST'):
+        from async_db_utils import get_db_pool
+        try:
+            await get_db_pool()
+        except Exception as e:
+            logging.error(f"Warmup: cannot open the database pool: {e}")
+    await asyncio.to_thread(run_warmup, app)
+
+
+@app.after_serving
+async def shutdown():
+    """Release pooled connections when the worker stops"""
+    from async_db_utils import close_db_pool
+    await close_db_pool()
+
+
+def respond(result):
+    """Turn a handler's (payload, status, headers) into a Quart response"""
+    payload, status, headers = result
+    return jsonify(payload), status, headers
+
+
+def error_response(message, status):
+    """Build the standard error payload"""
+    return respond(handlers.failure(message, status))
+
+
+def parse_fieldset_or_400(resource):
+    """Parse ?fields= / ?include=; returns (fieldset, error response)"""
+    try:
+        return parse_fieldset(resource, request.args), None
+    except ValueError as ve:
+        return None, error_response(str(ve), 400)
+
+
+async def snapshot_response(snapshot, key, resource, fieldset):
+    """Respond with a listing of a model snapshot, serialized once per snapshot and fieldset"""
+    def build():
+        body = app.json.dumps({
+            'success': True,
+            key: serialize_many(resource, snapshot, fieldset)
+        }).encode('utf-8')
+        return body, hashlib.sha256(body).hexdigest()[:16]
+
+    body, etag = snapshot.memo((key, fieldset), build)
+    response = Response(body, mimetype=app.json.mimetype)
+    response.set_etag(etag)
+    return await response.make_conditional(request)
+
+
+async def call_models(fn, *args, **kwargs):
+    """
+    Run a models-layer call (or a handler) without blocking the event loop
+
+    With Redis configured, lookups, invalidations and event publishing make
+    blocking Redis round trips (and a cache miss may wait for another
+    worker's load), so the call runs in a thread. The in-memory path is
+    quick and runs inline.
+    """
+    if get_redis() is None:
+        return fn(*args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+async def call_intake(fn, *args, **kwargs):
+    """Like call_models, but always in a thread when the order queue (SQLite) is in use"""
+    if get_intake_config()['mode'] == 'sync':
+        return await call_models(fn, *args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+@app.route('/healthz')
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'}), 200
+
+
+@app.route('/readyz')
+async def readyz():
+    """Readiness: warmup has finished in this process"""
+    if not is_ready():
+        return jsonify({'status': 'warming up'}), 503
+    return jsonify({'status': 'ready'}), 200
+
+
+# ---------------------------
+# Frontend Routes
+# ---------------------------
+@app.route('/')
+async def index():
+    """Render the main documentation page"""
+    return await render_template('index.html')
+
+
+@app.route('/metrics')
+async def get_metrics():
+    """Expose service metrics in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain')
+
+
+# ---------------------------
+# User Service API
+# ---------------------------
+@app.route('/api/users', methods=['GET'])
+async def get_users():
+    """Get all users"""
+    fieldset, error = parse_fieldset_or_400('user')
+    if error:
+        return error
+    return await snapshot_response(User.snapshot(), 'users', 'user', fieldset)
+
+
+@app.route('/api/users/<user_id>', methods=['GET'])
+async def get_user(user_id):
+    """Get a specific user by ID"""
+    fieldset, error = parse_fieldset_or_400('user')
+    if error:
+        return error
+    return respond(await call_models(handlers.get_user, user_id, fieldset))
+
+
+@app.route('/api/users', methods=['POST'])
+async def create_user():
+    """Create a new user"""
+    return respond(await call_models(handlers.create_user, await request.get_json()))
+
+
+@app.route('/api/users/<user_id>', methods=['PUT'])
+async def update_user(user_id):
+    """Update a user's details"""
+    return respond(await call_models(handlers.update_user, user_id, await request.get_json()))
+
+
+@app.route('/api/users/<user_id>', methods=['DELETE'])
+async def delete_user(user_id):
+    """Delete a user"""
+    return respond(await call_models(handlers.delete_user, user_id))
+
+
+# ---------------------------
+# Product Service API
+# ---------------------------
+@app.route('/api/products', methods=['GET'])
+async def get_products():
+    """Get all products"""
+    fieldset, error = parse_fieldset_or_400('product')
+    if error:
+        return error
+    return await snapshot_response(Product.snapshot(), 'products', 'product', fieldset)
+
+
+@app.route('/api/products/<product_id>', methods=['GET'])
+async def get_product(product_id):
+    """Get a specific product by ID"""
+    fieldset, error = parse_fieldset_or_400('product')
+    if error:
+        return error
+    return respond(await call_models(handlers.get_product, product_id, fieldset))
+
+
+@app.route('/api/products', methods=['POST'])
+async def create_product():
+    """Create a new product"""
+    return respond(await call_models(handlers.create_product, await request.get_json()))
+
+
+@app.route('/api/products/<product_id>', methods=['PUT'])
+async def update_product(product_id):
+    """Update a product's details"""
+    return respond(await call_models(handlers.update_product, product_id, await request.get_json()))
+
+
+@app.route('/api/products/<product_id>', methods=['DELETE'])
+async def delete_product(product_id):
+    """Delete a product"""
+    return respond(await call_models(handlers.delete_product, product_id))
+
+
+# ---------------------------
+# Order Service API
+# ---------------------------
+@app.route('/api/orders', methods=['GET'])
+async def get_orders():
+    """Get all orders"""
+    fieldset, error = parse_fieldset_or_400('order')
+    if error:
+        return error
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return await snapshot_response(Order.snapshot(), 'orders', 'order', fieldset)
+    return respond(await call_models(handlers.get_user_orders, user_id, fieldset))
+
+
+@app.route('/api/orders/events', methods=['GET'])
+async def order_events():
+    """Stream order-created and status-changed events (Server-Sent Events)"""
+    try:
+        last_event_id = handlers.parse_last_event_id(request.headers, request.args)
+    except ValueError as ve:
+        return error_response(str(ve), 400)
+
+    response = Response(astream_events(get_broadcaster(), last_event_id),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.timeout = None
+    return response
+
+
+@app.route('/api/orders/export', methods=['GET'])
+async def export_orders():
+    """Stream every order with its items as CSV or NDJSON (gzipped if accepted)"""
+    try:
+        fmt, after, fieldset = handlers.parse_export_request(request.args)
+    except ValueError as ve:
+        return error_response(str(ve), 400)
+
+    compress = bool(request.accept_encodings['gzip'])
+    exporter = OrderExporter(fmt, compress=compress, header=after is None,
+                             fieldset=fieldset)
+    response = Response(astream_export(exporter, aiter_order_rows(after, fieldset)),
+                        mimetype=EXPORT_FORMATS[fmt],
+                        headers=handlers.export_headers(fmt, compress))
+    response.timeout = None
+    return response
+
+
+@app.route('/api/orders/<order_id>', methods=['GET'])
+async def get_order(order_id):
+    """Get a specific order by ID"""
+    fieldset, error = parse_fieldset_or_400('order')
+    if error:
+        return error
+    return respond(await call_intake(handlers.get_order, order_id, fieldset))
+
+
+@app.route('/api/orders', methods=['POST'])
+@aidempotent
+async def create_order():
+    """Create a new order (retries with the same Idempotency-Key are replayed)"""
+    data = await request.get_json()
+    return respond(await call_intake(handlers.create_order, data, is_async_request(request)))
+
+
+@app.route('/api/orders/<order_id>/status', methods=['PUT'])
+async def update_order_status(order_id):
+    """Update an order's status"""
+    return respond(await call_models(handlers.update_order_status, order_id, await request.get_json()))
+
+
+@app.errorhandler(Exception)
+async def handle_error(e):
+    """Log unexpected errors and return the standard error payload"""
+    if getattr(e, 'code', None):
+        return e
+    logging.error(f"Error handling {request.method} {request.path}: {e}")
+    return error_response(str(e), 500)
+
+
+init_async_admission(app)
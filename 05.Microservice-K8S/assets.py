@@ -0,0 +1,126 @@
+"""
+Static asset pipeline: content-hashed, precompressed assets
+
+Build step (run once at image build time):
+    python assets.py
+
+copies every CSS/JS/SVG file under static/ to static/dist/ with a content
+hash in its name, writes .gz (and .br when brotli is installed) siblings,
+and records the mapping in static/dist/manifest.json.
+
+At runtime, templates call ``asset_url('css/style.css')``. When the manifest
+exists this points at /assets/<hashed name>, served straight from the
+precompressed files with an immutable, year-long Cache-Control. Without a
+build it falls back to the regular /static URL.
+"""
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import mimetypes
+
+from flask import request, url_for, send_from_directory, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_FILE = os.path.join(DIST_DIR, 'manifest.json')
+
+ASSET_EXTENSIONS = {'.css', '.js', '.svg'}
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def build_assets(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """Fingerprint and precompress static assets; return the manifest"""
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist_dir]
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if ext not in ASSET_EXTENSIONS:
+                continue
+            source = os.path.join(root, name)
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            logical = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            hashed = os.path.join(os.path.dirname(logical), f'{stem}.{digest}{ext}').replace(os.sep, '/')
+            target = os.path.join(dist_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            with open(target, 'wb') as f:
+                f.write(data)
+            with open(target + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(target + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+            manifest[logical] = hashed
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(path=MANIFEST_FILE):
+    """Load the asset manifest, or an empty one if assets were not built"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logging.info("No asset manifest found; serving unversioned static files")
+        return {}
+
+
+def init_assets(app):
+    """Register the asset_url template helper and the /assets route"""
+    manifest = load_manifest()
+
+    @app.template_global()
+    def asset_url(filename):
+        """URL of a static asset, fingerprinted when the build step has run"""
+        hashed = manifest.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('serve_asset', filename=hashed)
+
+    @app.route('/assets/<path:filename>')
+    def serve_asset(filename):
+        """Serve a fingerprinted asset, precompressed when the client accepts it"""
+        path = safe_join(DIST_DIR, filename)
+        if path is None or filename.endswith(('.gz', '.br')):
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        served = filename
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and \
+                    os.path.exists(path + suffix):
+                encoding, served = candidate, filename + suffix
+                break
+
+        response = send_from_directory(DIST_DIR, served, mimetype=mimetype, max_age=31536000)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+if __name__ == '__main__':
+    built = build_assets()
+    print(f"Built {len(built)} assets into {DIST_DIR}")
@@ -0,0 +1,104 @@
+"""
+Async database utility functions for the ASGI serving mode
+
+Mirrors db_utils on top of an asyncpg connection pool, so coroutines wait on
+PostgreSQL without holding a worker thread.
+"""
+import os
+import logging
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+_pool = None
+
+
+def get_db_config():
+    """Get database configuration from environment variables"""
+    return {
+        'database': os.environ.get('PGDATABASE'),
+        'user': os.environ.get('PGUSER'),
+        'password': os.environ.get('PGPASSWORD'),
+        'host': os.environ.get('PGHOST'),
+        'port': int(os.environ.get('PGPORT', 5432)),
+        'min_size': int(os.environ.get('PGPOOL_MIN_SIZE', 1)),
+        'max_size': int(os.environ.get('PGPOOL_MAX_SIZE', 10)),
+    }
+
+
+async def get_db_pool():
+    """Get the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        try:
+            _pool = await asyncpg.create_pool(**get_db_config())
+        except (OSError, asyncpg.PostgresError) as e:
+            logging.error(f"Database connection error: {e}")
+            raise
+    return _pool
+
+
+async def close_db_pool():
+    """Close the connection pool (on application shutdown)"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+@asynccontextmanager
+async def get_db_connection(transaction=False):
+    """
+    Async context manager for pooled database connections
+
+    Usage:
+        async with get_db_connection(transaction=True) as conn:
+            await conn.execute(...)
+    """
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        if not transaction:
+            yield conn
+            return
+        try:
+            async with conn.transaction():
+                yield conn
+        except asyncpg.PostgresError as e:
+            logging.error(f"Database error: {e}")
+            raise
+
+
+async def stream_query(sql, *args, batch_size=1000):
+    """
+    Async generator over the rows of a query, batch_size rows at a time
+
+    Uses a server-side cursor inside a read-only transaction, so memory stays
+    constant however many rows match.
+    """
+    async with get_db_connection() as conn:
+        try:
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(sql, *args)
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+        except asyncpg.PostgresError as e:
+            logging.error(f"Database error: {e}")
+            raise
+
+
+async def execute_sql_file(filename):
+    """Execute SQL statements from a file"""
+    try:
+        with open(filename, 'r') as f:
+            sql = f.read()
+
+        async with get_db_connection(transaction=True) as conn:
+            await conn.execute(sql)
+            logging.info(f"Successfully executed SQL file: {filename}")
+    except Exception as e:
+        logging.error(f"Error executing SQL file {filename}: {e}")
+        raise
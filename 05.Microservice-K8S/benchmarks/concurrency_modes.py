@@ -0,0 +1,162 @@
+"""
+Benchmark: concurrent connections per worker, WSGI vs ASGI serving mode
+
+Starts one gunicorn worker per serving mode and drives GET /bench/io, a
+route that waits IO_DELAY seconds to stand in for a PostgreSQL/Redis round
+trip (time.sleep in the WSGI app, asyncio.sleep in the ASGI app), at
+increasing client concurrency. Reports throughput and latency percentiles
+for each mode:
+
+    wsgi-sync     one sync worker, one request at a time
+    wsgi-gthread  the default: a worker with a thread pool (--threads)
+    asgi          uvicorn worker running the Quart app
+
+Usage:
+    python benchmarks/concurrency_modes.py [--duration 5] [--io-delay 0.05]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {
+    # gunicorn silently upgrades sync to gthread when --threads > 1
+    'wsgi-sync': ['--worker-class', 'sync', '--threads', '1'],
+    'wsgi-gthread': ['--worker-class', 'gthread', '--threads', '{threads}'],
+    'asgi': ['--worker-class', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+def _build_app():
+    """Gunicorn entry point: the selected app plus a simulated-I/O route"""
+    delay = float(os.environ.get('BENCH_IO_DELAY', 0.05))
+    if os.environ.get('SERVER_MODE') == 'asgi':
+        from asgi import app as asgi_app
+
+        @asgi_app.route('/bench/io')
+        async def bench_io():
+            await asyncio.sleep(delay)
+            return {'success': True}
+
+        return asgi_app
+
+    from app import app as flask_app
+
+    @flask_app.route('/bench/io')
+    def bench_io():
+        time.sleep(delay)
+        return {'success': True}
+
+    return flask_app
+
+
+if os.environ.get('BENCH_SERVER') == '1':
+    app = _build_app()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def drive(url, concurrency, duration):
+    """Keep `concurrency` requests in flight for `duration` seconds"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < stop:
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=60) as resp:
+                    resp.read()
+            except OSError:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def run_mode(mode, args):
+    """Start one worker in the given mode and measure every concurrency level"""
+    port = _free_port()
+    env = dict(os.environ,
+               BENCH_SERVER='1',
+               BENCH_IO_DELAY=str(args.io_delay),
+               SERVER_MODE='asgi' if mode == 'asgi' else 'wsgi',
+               ADMISSION_ENABLED='0')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--chdir', ROOT, '--bind', f'127.0.0.1:{port}',
+         '--workers', '1', '--backlog', '2048', '--log-level', 'warning',
+         *[arg.format(threads=args.threads) for arg in MODES[mode]],
+         'benchmarks.concurrency_modes:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}/bench/io'
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(url, timeout=5).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        return [dict(drive(url, concurrency, args.duration), mode=mode)
+                for concurrency in args.concurrency]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--io-delay', type=float, default=0.05)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        results.extend(run_mode(mode, args))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
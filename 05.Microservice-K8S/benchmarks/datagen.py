@@ -0,0 +1,107 @@
+"""
+Synthetic data generator for benchmarks
+
+Seeds the in-memory models with a configurable number of users, products and
+orders. The shape is meant to look like real traffic rather than uniform noise:
+
+- Product and user popularity follow a Zipf-like curve, so a few hot
+  products appear in most orders and a few users place most of them.
+- Item counts per order are geometric with mean ITEMS_MEAN (capped at
+  MAX_ITEMS), and quantities are mostly 1.
+- A share of orders has moved on to shipped or delivered.
+
+Generation is deterministic for a given seed, apart from the UUIDs.
+
+Usage:
+    python benchmarks/datagen.py [--users 1000] [--products 500] [--orders 5000]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from itertools import accumulate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ITEMS_MEAN = 2.5
+MAX_ITEMS = 10
+QUANTITIES = [1, 1, 1, 1, 2, 2, 3]
+STATUSES = [('pending', 0.3), ('shipped', 0.3), ('delivered', 0.4)]
+
+
+def zipf_weights(n, exponent=1.0):
+    """Cumulative weights for picking rank i with probability ~ 1 / (i + 1)^exponent"""
+    return list(accumulate(1.0 / (rank + 1) ** exponent for rank in range(n)))
+
+
+def item_count(rng, mean=ITEMS_MEAN, cap=MAX_ITEMS):
+    """Geometric number of distinct items in an order (at least 1)"""
+    count = 1
+    while count < cap and rng.random() > 1.0 / mean:
+        count += 1
+    return count
+
+
+def seed(users=1000, products=500, orders=5000, seed=42):
+    """Populate the models; returns the created ids and popularity weights"""
+    from models import User, Product, Order
+
+    rng = random.Random(seed)
+    user_ids = [User.create(username=f'user{i}', email=f'user{i}@example.com').id
+                for i in range(users)]
+    product_ids = [Product.create(name=f'Product {i}', description=f'Synthetic product {i}',
+                                  price=round(rng.uniform(2, 500), 2), stock=10 ** 9).id
+                   for i in range(products)]
+
+    user_weights = zipf_weights(len(user_ids))
+    product_weights = zipf_weights(len(product_ids))
+    statuses, status_weights = zip(*STATUSES)
+    order_ids = []
+    for _ in range(orders):
+        user_id = rng.choices(user_ids, cum_weights=user_weights)[0]
+        picked = set(rng.choices(product_ids, cum_weights=product_weights, k=item_count(rng)))
+        order = Order.create(user_id=user_id, items=[
+            {'product_id': product_id, 'quantity': rng.choice(QUANTITIES)}
+            for product_id in picked
+        ])
+        status = rng.choices(statuses, weights=status_weights)[0]
+        if status != 'pending':
+            Order.update_status(order.id, status)
+        order_ids.append(order.id)
+
+    return {
+        'user_ids': user_ids,
+        'product_ids': product_ids,
+        'order_ids': order_ids,
+        'user_weights': user_weights,
+        'product_weights': product_weights,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from models import Order
+    started = time.perf_counter()
+    data = seed(args.users, args.products, args.orders, args.seed)
+    items = [len(order.items) for order in Order.get_all()]
+    print(json.dumps({
+        'users': len(data['user_ids']),
+        'products': len(data['product_ids']),
+        'orders': len(data['order_ids']),
+        'items_per_order_mean': round(sum(items) / max(len(items), 1), 2),
+        'items_per_order_max': max(items, default=0),
+        'seconds': round(time.perf_counter() - started, 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,490 @@
+"""
+Benchmark suite: HTTP load scenarios against the API, with regression checks
+
+Seeds synthetic data (benchmarks/datagen.py) and drives three scenarios:
+
+    browse    read-heavy catalogue browsing: product pages (hot products
+              most often), sparse and full product listings, the index page
+    checkout  bursts of order creation: every client fires a burst of
+              POST /api/orders at each tick, then waits for the next one
+    history   users looking at their order history and single orders
+
+in two modes:
+
+    inprocess  Flask test client, no network or server in the way; shows
+               the cost of routes.py/models.py itself
+    gunicorn   a local gunicorn started with gunicorn.conf.py (preloaded,
+               data seeded in the master), over HTTP keep-alive connections
+
+For each mode and scenario it reports throughput, p50/p95/p99 latency, the
+error count and peak RSS (the process itself in-process; master plus
+workers under gunicorn) as JSON, each the median of --repeat runs. With --baseline the results are compared
+against a stored run and the exit status is 1 if any metric regressed by
+more than --tolerance; --save-baseline stores the current run.
+
+Usage:
+    python benchmarks/http_suite.py [--duration 5] [--modes inprocess gunicorn]
+    python benchmarks/http_suite.py --baseline benchmarks/baseline.json
+    python benchmarks/http_suite.py --save-baseline benchmarks/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import datagen  # noqa: E402
+
+SCENARIOS = ('browse', 'checkout', 'history')
+MODES = ('inprocess', 'gunicorn')
+
+# Compared against the baseline: metric -> whether higher is better
+COMPARED_METRICS = {
+    'throughput_rps': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'peak_rss_mb': False,
+}
+
+
+def get_volumes():
+    """Data volumes, shared by the driver and the gunicorn server via the environment"""
+    return {
+        'users': int(os.environ.get('BENCH_USERS', 1000)),
+        'products': int(os.environ.get('BENCH_PRODUCTS', 500)),
+        'orders': int(os.environ.get('BENCH_ORDERS', 5000)),
+    }
+
+
+def _build_app():
+    """Gunicorn entry point: the real app, seeded once in the (preloading) master"""
+    from app import app as flask_app
+    logging.getLogger().setLevel(logging.WARNING)
+    datagen.seed(**get_volumes())
+    return flask_app
+
+
+if os.environ.get('BENCH_SERVER') == '1':
+    app = _build_app()
+
+
+# ---------------------------
+# Targets
+# ---------------------------
+class InProcessTarget:
+    """Requests through the Flask test client, one client per thread"""
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+
+class HttpTarget:
+    """Requests over HTTP with one keep-alive connection per thread"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            return 0
+
+    def get_json(self, path):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            conn.request('GET', path)
+            return json.loads(conn.getresponse().read())
+        finally:
+            conn.close()
+
+
+# ---------------------------
+# Scenarios
+# ---------------------------
+class Workload:
+    """Picks requests for a scenario from the seeded ids, hot keys most often"""
+
+    def __init__(self, data):
+        self.user_ids = data['user_ids']
+        self.product_ids = data['product_ids']
+        self.user_weights = datagen.zipf_weights(len(self.user_ids))
+        self.product_weights = datagen.zipf_weights(len(self.product_ids))
+        self.orders_by_user = data['orders_by_user']
+
+    def hot_product(self, rng):
+        return rng.choices(self.product_ids, cum_weights=self.product_weights)[0]
+
+    def hot_user(self, rng):
+        return rng.choices(self.user_ids, cum_weights=self.user_weights)[0]
+
+    def browse(self, rng):
+        roll = rng.random()
+        if roll < 0.60:
+            return 'GET', f'/api/products/{self.hot_product(rng)}', None
+        if roll < 0.85:
+            return 'GET', '/api/products?fields=id,name,price', None
+        if roll < 0.95:
+            return 'GET', '/api/products', None
+        return 'GET', '/', None
+
+    def checkout(self, rng):
+        picked = set(rng.choices(self.product_ids, cum_weights=self.product_weights,
+                                 k=datagen.item_count(rng)))
+        return 'POST', '/api/orders', {
+            'user_id': self.hot_user(rng),
+            'items': [{'product_id': product_id, 'quantity': rng.choice(datagen.QUANTITIES)}
+                      for product_id in picked],
+        }
+
+    def history(self, rng):
+        user_id = self.hot_user(rng)
+        orders = self.orders_by_user.get(user_id)
+        if orders and rng.random() < 0.3:
+            return 'GET', f'/api/orders/{rng.choice(orders)}', None
+        if rng.random() < 0.5:
+            return 'GET', f'/api/orders?user_id={user_id}&fields=id,status,total', None
+        return 'GET', f'/api/orders?user_id={user_id}', None
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def _rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The ppid follows the parenthesised command name
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return children
+
+
+class RssSampler:
+    """Tracks the peak combined RSS of a process and its children"""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        pids = [self.pid] + _children(self.pid)
+        self.peak_kb = max(self.peak_kb, sum(_rss_kb(pid) for pid in pids))
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if os.path.isdir('/proc'):
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+            self._sample()
+        elif self.pid == os.getpid():
+            import resource
+            self.peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def drive(target, workload, scenario, args, rss_pid):
+    """Run one scenario with `args.concurrency` clients and summarise it"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    pick = getattr(workload, scenario)
+    stop = time.monotonic() + args.duration
+    started = time.monotonic()
+
+    def client(slot):
+        rng = random.Random(slot)
+        local_latencies, local_errors = [], 0
+        next_burst = started
+        while time.monotonic() < stop:
+            count = 1
+            if scenario == 'checkout':
+                # Wait for the next tick, then fire the whole burst
+                time.sleep(max(0.0, next_burst - time.monotonic()))
+                next_burst += args.burst_interval
+                count = args.burst_size
+            for _ in range(count):
+                method, path, body = pick(rng)
+                request_started = time.perf_counter()
+                status = target.request(method, path, body)
+                if 200 <= status < 400:
+                    local_latencies.append(time.perf_counter() - request_started)
+                else:
+                    local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client, args=(slot,)) for slot in range(args.concurrency)]
+    with RssSampler(rss_pid) as sampler:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'scenario': scenario,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+        'peak_rss_mb': round(sampler.peak_kb / 1024, 1),
+    }
+
+
+def measure(target, workload, scenario, args, rss_pid):
+    """Run a scenario args.repeat times; report the median of each metric"""
+    runs = [drive(target, workload, scenario, args, rss_pid) for _ in range(args.repeat)]
+    summary = dict(runs[len(runs) // 2])
+    for metric in ('requests', 'errors', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+        summary[metric] = sorted(run[metric] for run in runs)[len(runs) // 2]
+    summary['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+    return summary
+
+
+def _index_orders(orders):
+    by_user = {}
+    for order in orders:
+        by_user.setdefault(order['user_id'], []).append(order['id'])
+    return by_user
+
+
+def _bench_env():
+    # Measure the application, not the rate limiter or log output
+    return dict(os.environ, ADMISSION_ENABLED='0', PYTHONUNBUFFERED='1')
+
+
+def run_inprocess(args):
+    """All scenarios against the Flask app in this process"""
+    os.environ.update(_bench_env())
+    from app import app as flask_app
+    from models import Order
+    logging.getLogger().setLevel(logging.WARNING)
+
+    data = datagen.seed(**get_volumes())
+    data['orders_by_user'] = _index_orders(
+        {'id': order.id, 'user_id': order.user_id} for order in Order.get_all())
+    workload = Workload(data)
+    target = InProcessTarget(flask_app)
+    return [dict(measure(target, workload, scenario, args, os.getpid()), mode='inprocess')
+            for scenario in args.scenarios]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_gunicorn(args):
+    """All scenarios against a local gunicorn serving the seeded app"""
+    port = _free_port()
+    env = dict(_bench_env(), BENCH_SERVER='1', WEB_CONCURRENCY=str(args.workers),
+               **{f'BENCH_{name.upper()}': str(value) for name, value in get_volumes().items()})
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--chdir', ROOT, '--config', 'gunicorn.conf.py',
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+         *args.gunicorn_args.split(), 'benchmarks.http_suite:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    target = HttpTarget('127.0.0.1', port)
+    try:
+        for _ in range(600):
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            try:
+                if target.get_json('/readyz').get('status') == 'ready':
+                    break
+            except (OSError, ValueError, http.client.HTTPException):
+                pass
+            time.sleep(0.1)
+        # Every worker inherited the same data from the master
+        data = {
+            'user_ids': [user['id'] for user in target.get_json('/api/users?fields=id')['users']],
+            'product_ids': [product['id'] for product in
+                            target.get_json('/api/products?fields=id')['products']],
+            'orders_by_user': _index_orders(target.get_json('/api/orders?fields=id,user_id')['orders']),
+        }
+        # Listings come back in store order: make the users with the most
+        # orders the hottest, as in the seeded data
+        data['user_ids'].sort(key=lambda user_id: -len(data['orders_by_user'].get(user_id, ())))
+        workload = Workload(data)
+        return [dict(measure(target, workload, scenario, args, server.pid), mode='gunicorn')
+                for scenario in args.scenarios]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+# ---------------------------
+# Baseline comparison
+# ---------------------------
+def compare(results, baseline, tolerance, min_delta_ms=1.0):
+    """
+    List the metrics that got worse than the baseline by more than tolerance
+
+    Latency changes smaller than min_delta_ms are ignored: sub-millisecond
+    percentiles move by large ratios on noise alone.
+    """
+    previous = {(entry['mode'], entry['scenario']): entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        base = previous.get((entry['mode'], entry['scenario']))
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = base.get(metric), entry.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if metric.endswith('_ms') and new - old < min_delta_ms:
+                continue
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({
+                    'mode': entry['mode'],
+                    'scenario': entry['scenario'],
+                    'metric': metric,
+                    'baseline': old,
+                    'current': new,
+                    'change_pct': round(change * 100, 1),
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per scenario; the median is reported (default 3)')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--burst-size', type=int, default=5)
+    parser.add_argument('--burst-interval', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--gunicorn-args', default='',
+                        help="extra gunicorn arguments, e.g. '--worker-class gthread --threads 4'")
+    parser.add_argument('--users', type=int, help='default: BENCH_USERS or 1000')
+    parser.add_argument('--products', type=int, help='default: BENCH_PRODUCTS or 500')
+    parser.add_argument('--orders', type=int, help='default: BENCH_ORDERS or 5000')
+    parser.add_argument('--baseline', help='compare against this stored run')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='allowed relative regression per metric (default 0.15)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='ignore latency regressions smaller than this (default 1.0)')
+    parser.add_argument('--save-baseline', help='store this run as a baseline')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    for name in ('users', 'products', 'orders'):
+        if getattr(args, name) is not None:
+            os.environ[f'BENCH_{name.upper()}'] = str(getattr(args, name))
+
+    results = []
+    # The server first: the in-process run leaves seeded data in this process
+    if 'gunicorn' in args.modes:
+        results.extend(run_gunicorn(args))
+    if 'inprocess' in args.modes:
+        results.extend(run_inprocess(args))
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'volumes': get_volumes(),
+            'duration': args.duration,
+            'concurrency': args.concurrency,
+            'repeat': args.repeat,
+            'workers': args.workers,
+        },
+        'results': results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatched = [key for key, value in report['meta'].items()
+                      if baseline['meta'].get(key) != value]
+        if mismatched:
+            report['warnings'] = [f"baseline was recorded with different {', '.join(mismatched)}; "
+                                  f"results are not directly comparable"]
+        report['regressions'] = compare(results, baseline, args.tolerance, args.min_delta_ms)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'meta': report['meta'], 'results': results}, f, indent=2)
+            f.write('\n')
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Load test for admission control
+
+Runs the API under gunicorn (one gthread worker) twice, with admission
+control off and on. In both runs a pool of clients floods POST /api/orders,
+whose handler is slowed down to stand in for payment/notification calls,
+while a smaller pool issues GET /api/products and records latency.
+
+Without admission control the writes take every worker thread and reads
+queue behind them. With it, the write endpoint's concurrency limit keeps
+threads free for reads and excess writes are shed early with 503; the
+write clients honour Retry-After like well-behaved callers would.
+
+Usage:
+    python benchmarks/load_admission.py [--duration 10] [--write-delay 0.2]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _build_app():
+    """Gunicorn entry point: the real app with seeded data and a slow order path"""
+    from app import app as flask_app
+    from models import User, Product, Order
+
+    delay = float(os.environ.get('LOADTEST_WRITE_DELAY', 0.2))
+    create = Order.create.__func__
+
+    def slow_create(cls, user_id, items):
+        time.sleep(delay)
+        return create(cls, user_id, items)
+
+    Order.create = classmethod(slow_create)
+    User.create(username='loadtest', email='loadtest@example.com')
+    for i in range(50):
+        Product.create(name=f'Product {i}', description='Load test product',
+                       price=10.0 + i, stock=10 ** 9)
+    return flask_app
+
+
+if os.environ.get('LOADTEST_SERVER') == '1':
+    app = _build_app()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _request(url, data=None):
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            payload = resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        payload = e.read()
+        status = e.code
+        retry_after = e.headers.get('Retry-After')
+        if retry_after:
+            time.sleep(float(retry_after))
+    return status, time.perf_counter() - started, payload
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run_scenario(admission, args):
+    """Start a server, drive the mixed load, and return read/write statistics"""
+    port = _free_port()
+    env = dict(os.environ,
+               LOADTEST_SERVER='1',
+               LOADTEST_WRITE_DELAY=str(args.write_delay),
+               ADMISSION_ENABLED='1' if admission else '0',
+               ADMISSION_CLIENT_READ_RATE='100000',
+               ADMISSION_CLIENT_WRITE_RATE='100000',
+               ADMISSION_READ_RATE='100000',
+               ADMISSION_WRITE_RATE='100000',
+               ADMISSION_WRITE_CONCURRENCY=str(args.write_concurrency),
+               ADMISSION_WRITE_QUEUE=str(args.write_queue),
+               ADMISSION_QUEUE_BUDGET=str(args.queue_budget))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--chdir', ROOT, '--bind', f'127.0.0.1:{port}',
+         '--worker-class', 'gthread', '--workers', '1', '--threads', str(args.threads),
+         '--log-level', 'warning', 'benchmarks.load_admission:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        for _ in range(100):
+            try:
+                _request(base + '/metrics')
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        _, _, body = _request(base + '/api/users')
+        user_id = json.loads(body)['users'][0]['id']
+        _, _, body = _request(base + '/api/products')
+        product_id = json.loads(body)['products'][0]['id']
+        order = {'user_id': user_id, 'items': [{'product_id': product_id, 'quantity': 1}]}
+
+        stop = time.monotonic() + args.duration
+        read_latencies, write_statuses = [], {}
+        lock = threading.Lock()
+
+        def writer():
+            while time.monotonic() < stop:
+                status, _, _ = _request(base + '/api/orders', order)
+                with lock:
+                    write_statuses[status] = write_statuses.get(status, 0) + 1
+
+        def reader():
+            while time.monotonic() < stop:
+                status, latency, _ = _request(base + '/api/products')
+                if status == 200:
+                    with lock:
+                        read_latencies.append(latency)
+
+        threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+        threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'admission': admission,
+        'reads': len(read_latencies),
+        'read_p50_ms': round(_percentile(read_latencies, 50) * 1000, 2),
+        'read_p99_ms': round(_percentile(read_latencies, 99) * 1000, 2),
+        'write_statuses': write_statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--write-delay', type=float, default=0.2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=32)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--write-concurrency', type=int, default=3)
+    parser.add_argument('--write-queue', type=int, default=1)
+    parser.add_argument('--queue-budget', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = [run_scenario(False, args), run_scenario(True, args)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
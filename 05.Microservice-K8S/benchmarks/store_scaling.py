@@ -0,0 +1,125 @@
+"""
+Benchmark: thread scaling of the sharded store vs a single global lock
+
+Each thread runs a mixed workload against a store of products: reads
+(get by id), read-modify-write stock updates under the key's lock, and an
+occasional full listing. The same workload runs against ShardedStore and
+against a plain dict guarded by one lock, for 1 to 32 threads, and reports
+total operations per second.
+
+On a GIL build of CPython both stores are limited by the interpreter lock;
+the comparison shows what the locking strategy itself costs under
+contention. On a free-threaded build the sharded store scales with cores.
+
+Usage:
+    python benchmarks/store_scaling.py [--duration 2] [--write-ratio 0.2]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sharded_store import ShardedStore  # noqa: E402
+
+
+@dataclass
+class Item:
+    id: str
+    stock: int
+
+
+class GlobalLockStore:
+    """Baseline: one dict and one lock for every operation"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    @contextmanager
+    def locked(self, *keys):
+        with self._lock:
+            yield self
+
+    def values(self):
+        with self._lock:
+            return list(self._data.values())
+
+
+def run(store, threads, duration, write_ratio, list_ratio, keys):
+    """Drive the mixed workload and return total operations per second"""
+    counts = [0] * threads
+    stop = time.monotonic() + duration
+
+    def worker(slot):
+        rng = random.Random(slot)
+        ops = 0
+        while time.monotonic() < stop:
+            for _ in range(100):
+                roll = rng.random()
+                key = keys[rng.randrange(len(keys))]
+                if roll < list_ratio:
+                    store.values()
+                elif roll < list_ratio + write_ratio:
+                    with store.locked(key):
+                        item = store.get(key)
+                        store[key] = replace(item, stock=item.stock - 1)
+                else:
+                    store.get(key)
+            ops += 100
+        counts[slot] = ops
+
+    workers = [threading.Thread(target=worker, args=(slot,)) for slot in range(threads)]
+    started = time.monotonic()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(counts) / (time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--duration', type=float, default=2.0)
+    parser.add_argument('--keys', type=int, default=10000)
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--list-ratio', type=float, default=0.0001)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    keys = [f'product-{i}' for i in range(args.keys)]
+    results = []
+    for name, factory in (('global_lock', GlobalLockStore),
+                          ('sharded', lambda: ShardedStore(args.shards))):
+        store = factory()
+        for key in keys:
+            store[key] = Item(id=key, stock=10 ** 9)
+        for threads in args.threads:
+            ops = run(store, threads, args.duration, args.write_ratio, args.list_ratio, keys)
+            results.append({'store': name, 'threads': threads, 'ops_per_sec': round(ops)})
+
+    print(json.dumps({
+        'python': sys.version.split()[0],
+        'gil_enabled': getattr(sys, '_is_gil_enabled', lambda: True)(),
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""
+Cache module: Two-tier read-through cache for hot model lookups
+
+Tier 1 is an in-process LRU with TTL and size bounds. Tier 2 is Redis, shared
+by every worker and replica, used when REDIS_URL is set and CACHE_SHARED_TIER=1.
+Only enable the shared tier once the models live in a shared database: with
+the in-memory stores each process has its own data.
+
+Writers invalidate through the cache: the entry is dropped locally and in
+Redis, and the key is broadcast on a pub/sub channel so every other process
+drops its local copy too.
+
+A load that raced with an invalidation is not written back (each key has a
+generation counter), so an invalidated value cannot be reinstated by a slow
+reader. Loads are coalesced per key and generation, so a read that starts
+after an invalidation never shares a load that started before it.
+
+Misses are coalesced so a hot key is loaded once, not once per request:
+concurrent misses in a process share one load (single-flight), and with the
+shared tier a short Redis lock lets one worker load while the others wait
+for the value to appear. Entries past their TTL but within CACHE_STALE_TTL
+are served stale while a single background refresh reloads them.
+"""
+import os
+import time
+import json
+import uuid
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from redis_utils import get_redis
+from singleflight import SingleFlight
+
+INVALIDATION_CHANNEL = 'cache-invalidate'
+
+# Lookup results
+FRESH = 'fresh'
+STALE = 'stale'
+MISS = 'miss'
+
+# Delete the lock only if we still own it
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def get_cache_config():
+    """Get cache configuration from environment variables"""
+    return {
+        'enabled': os.environ.get('CACHE_ENABLED', '1') == '1',
+        'max_entries': int(os.environ.get('CACHE_MAX_ENTRIES', 10000)),
+        'ttl': float(os.environ.get('CACHE_TTL', 60)),
+        'stale_ttl': float(os.environ.get('CACHE_STALE_TTL', 30)),
+        'redis_ttl': int(os.environ.get('CACHE_REDIS_TTL', 300)),
+        'shared_tier': os.environ.get('CACHE_SHARED_TIER', '0') == '1',
+        'lock_ttl': float(os.environ.get('CACHE_LOCK_TTL', 2.0)),
+    }
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a TTL and a stale grace period per entry"""
+
+    def __init__(self, name, max_entries=10000, ttl=60, stale_ttl=0):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()  # key -> (fresh_until, stale_until, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (state, value) where state is FRESH, STALE or MISS"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS, None
+            now = time.monotonic()
+            if entry[1] <= now:
+                del self._entries[key]
+                return MISS, None
+            self._entries.move_to_end(key)
+            return (FRESH if entry[0] > now else STALE), entry[2]
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries over the bound"""
+        with self._lock:
+            now = time.monotonic()
+            self._entries[key] = (now + self.ttl, now + self.ttl + self.stale_ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.inc('cache_evictions_total', cache=self.name)
+
+    def delete(self, key):
+        """Drop a key if present"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TwoTierCache:
+    """Read-through cache: local LRU, then Redis, then the loader"""
+
+    def __init__(self, name, config=None):
+        config = config or get_cache_config()
+        self.name = name
+        self.enabled = config['enabled']
+        self.redis_ttl = config['redis_ttl']
+        self.shared_tier = config['shared_tier']
+        self.lock_ttl = config['lock_ttl']
+        self.local = LRUCache(name, config['max_entries'], config['ttl'], config['stale_ttl'])
+        self.flight = SingleFlight(name)
+        self._generations = {}
+        self._generation_lock = threading.Lock()
+        _caches[name] = self
+
+    def _redis_key(self, key):
+        return f'cache:{self.name}:{key}'
+
+    def _generation(self, key):
+        with self._generation_lock:
+            return self._generations.get(key, 0)
+
+    def get(self, key, loader):
+        """Get a value, calling loader(key) on a miss in both tiers"""
+        if not self.enabled:
+            return loader(key)
+
+        generation = self._generation(key)
+        state, value = self.local.get(key)
+        if state == FRESH:
+            metrics.inc('cache_hits_total', cache=self.name, tier='local')
+            return value
+        if state == STALE:
+            metrics.inc('cache_stale_served_total', cache=self.name)
+            if not self.flight.in_flight((key, generation)):
+                _refresh_pool.submit(self._refresh, key, loader, generation)
+            return value
+
+        return self.flight.do((key, generation), lambda: self._load(key, loader, generation))
+
+    def _refresh(self, key, loader, generation):
+        """Background revalidation of a stale entry"""
+        try:
+            self.flight.do((key, generation),
+                           lambda: self._load(key, loader, generation, refresh=True))
+            metrics.inc('cache_refreshes_total', cache=self.name)
+        except Exception as e:
+            logging.warning(f"Cache {self.name}: refresh of {key} failed: {e}")
+
+    def _load(self, key, loader, generation, refresh=False):
+        """
+        Load a key from Redis or the loader and fill the tiers
+
+        generation is the key's generation when the read started: the value
+        is cached only if no invalidation happened since.
+        """
+        client = _get_client() if self.shared_tier else None
+        if client is None:
+            metrics.inc('cache_misses_total', cache=self.name)
+            value = loader(key)
+            if value is not None:
+                self._fill_local(key, value, generation)
+            return value
+
+        if not refresh:
+            value = self._read_shared(client, key)
+            if value is not None:
+                metrics.inc('cache_hits_total', cache=self.name, tier='redis')
+                self._fill_local(key, value, generation)
+                return value
+
+        # Let one worker across the fleet hit the backend for this key
+        lock_key = self._redis_key(key) + ':lock'
+        token = uuid.uuid4().hex
+        try:
+            locked = client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception as e:
+            logging.warning(f"Cache {self.name}: Redis lock failed: {e}")
+            locked, client = False, None
+
+        if client is not None and not locked:
+            deadline = time.monotonic() + self.lock_ttl
+            while time.monotonic() < deadline:
+                time.sleep(0.02)
+                value = self._read_shared(client, key)
+                if value is not None:
+                    metrics.inc('cache_hits_total', cache=self.name, tier='redis')
+                    self._fill_local(key, value, generation)
+                    return value
+
+        metrics.inc('cache_misses_total', cache=self.name)
+        try:
+            value = loader(key)
+            if value is not None and self._fill_local(key, value, generation) and client:
+                try:
+                    client.set(self._redis_key(key), pickle.dumps(value), ex=self.redis_ttl)
+                except Exception as e:
+                    logging.warning(f"Cache {self.name}: Redis write failed: {e}")
+            return value
+        finally:
+            if locked:
+                try:
+                    client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    logging.warning(f"Cache {self.name}: Redis unlock failed: {e}")
+
+    def _read_shared(self, client, key):
+        try:
+            raw = client.get(self._redis_key(key))
+        except Exception as e:
+            logging.warning(f"Cache {self.name}: Redis read failed: {e}")
+            return None
+        return pickle.loads(raw) if raw is not None else None
+
+    def _fill_local(self, key, value, generation):
+        """Cache a loaded value unless the key was invalidated while loading"""
+        with self._generation_lock:
+            if self._generations.get(key, 0) != generation:
+                return False
+            self.local.set(key, value)
+            return True
+
+    def drop_local(self, key):
+        """Drop a key from this process's tier only"""
+        with self._generation_lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if len(self._generations) > self.local.max_entries * 2:
+                # Unknown keys read as generation 0, so stale counters can go
+                self._generations.clear()
+                self._generations[key] = 1
+        self.local.delete(key)
+
+    def invalidate(self, key):
+        """Drop a key everywhere: here, in Redis, and in every other process"""
+        if not self.enabled:
+            return
+        self.drop_local(key)
+        metrics.inc('cache_invalidations_total', cache=self.name)
+        client = _get_client() if self.shared_tier else None
+        if client is None:
+            return
+        try:
+            client.delete(self._redis_key(key))
+            client.publish(INVALIDATION_CHANNEL, json.dumps({'cache': self.name, 'key': key}))
+        except Exception as e:
+            logging.error(f"Cache {self.name}: invalidation broadcast failed for {key}: {e}")
+
+
+_caches = {}
+_refresh_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-refresh')
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def _listen_for_invalidations(client):
+    """Drop local entries invalidated by other processes"""
+    while True:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                payload = json.loads(message['data'])
+                cache = _caches.get(payload['cache'])
+                if cache is not None:
+                    cache.drop_local(payload['key'])
+        except Exception as e:
+            logging.error(f"Cache invalidation listener error: {e}")
+            # Anything could have changed while we were disconnected
+            for cache in _caches.values():
+                cache.local.clear()
+            time.sleep(1)
+
+
+def _get_client():
+    """Get the Redis client, starting this process's invalidation listener"""
+    global _listener_pid
+    client = get_redis()
+    if client is None or _listener_pid == os.getpid():
+        return client
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            threading.Thread(target=_listen_for_invalidations, args=(client,), daemon=True,
+                             name='cache-invalidation-listener').start()
+            _listener_pid = os.getpid()
+    return client
@@ -0,0 +1,112 @@
+"""
+Compression module: gzip/brotli response compression
+
+Compresses text-like responses above a size threshold according to the
+client's Accept-Encoding. Brotli is used when the brotli package is
+installed and the client prefers it; gzip otherwise. Responses that carry a
+strong ETag (such as the cached index page) have their compressed bodies
+cached, so they are only compressed once.
+"""
+import os
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/css',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+    'image/svg+xml',
+}
+
+
+def get_compression_config():
+    """Get compression configuration from environment variables"""
+    return {
+        'enabled': os.environ.get('COMPRESSION_ENABLED', '1') == '1',
+        'min_size': int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+        'gzip_level': int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6)),
+        'brotli_quality': int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4)),
+        'cache_entries': int(os.environ.get('COMPRESSION_CACHE_ENTRIES', 64)),
+    }
+
+
+def choose_encoding(accept_encodings):
+    """Pick 'br', 'gzip' or None from a parsed Accept-Encoding header"""
+    if brotli is not None and accept_encodings['br'] and \
+            accept_encodings['br'] >= accept_encodings['gzip']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, config):
+    """Compress bytes with the given content encoding"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['brotli_quality'])
+    return gzip.compress(data, compresslevel=config['gzip_level'], mtime=0)
+
+
+def init_compression(app):
+    """Install the response compression hook on the Flask app"""
+    config = get_compression_config()
+    if not config['enabled']:
+        return
+
+    cache = OrderedDict()
+    cache_lock = threading.Lock()
+
+    @app.after_request
+    def compress_response(response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code != 200
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < config['min_size']:
+            return response
+
+        etag, weak = response.get_etag()
+        cache_key = (etag, encoding) if etag and not weak else None
+        compressed = None
+        if cache_key:
+            with cache_lock:
+                compressed = cache.get(cache_key)
+                if compressed is not None:
+                    cache.move_to_end(cache_key)
+        if compressed is None:
+            compressed = compress(data, encoding, config)
+            if cache_key:
+                with cache_lock:
+                    cache[cache_key] = compressed
+                    while len(cache) > config['cache_entries']:
+                        cache.popitem(last=False)
+
+        metrics.inc('compression_bytes_in_total', len(data))
+        metrics.inc('compression_bytes_out_total', len(compressed))
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            # Like nginx, downgrade to a weak validator for the encoded body
+            response.set_etag(etag, weak=True)
+        return response
@@ -36,6 +36,9 @@ CREATE TABLE IF NOT EXISTS order_items (
     FOREIGN KEY (product_id) REFERENCES products(id)
 );
 
+-- Lets the order export stream orders with their items in key order
+CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id, id);
+
 -- Sample data for users
 INSERT INTO users (id, username, email) VALUES
     ('550e8400-e29b-41d4-a716-446655440000', 'john_doe', 'john@example.com'),
@@ -2,11 +2,17 @@
 Database utility functions for future PostgreSQL integration
 """
 import os
+import time
+import uuid
 import logging
+import threading
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from contextlib import contextmanager
 
+from query_stats import record_query, record_fetch
+
 # This module provides utility functions for database operations
 # For the MVP, we're using in-memory storage, but these functions
 # will be used when we transition to PostgreSQL
@@ -18,9 +24,69 @@ def get_db_config():
         'user': os.environ.get('PGUSER'),
         'password': os.environ.get('PGPASSWORD'),
         'host': os.environ.get('PGHOST'),
-        'port': os.environ.get('PGPORT', 5432)
+        'port': os.environ.get('PGPORT', 5432),
+        'connect_timeout': int(os.environ.get('PGCONNECT_TIMEOUT', 5))
     }
 
+def get_pool_config():
+    """Get connection pool sizing from environment variables"""
+    return {
+        'min_size': int(os.environ.get('PGPOOL_MIN_SIZE', 1)),
+        'max_size': int(os.environ.get('PGPOOL_MAX_SIZE', 10)),
+    }
+
+class InstrumentedCursor(RealDictCursor):
+    """RealDictCursor that reports each statement's timing to query_stats"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(self._statement(query), vars, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(self._statement(query), vars_list[0] if vars_list else None,
+                         time.perf_counter() - started)
+
+    def fetchmany(self, size=None):
+        # Named cursors do their database work here, batch by batch
+        if not self.name:
+            return super().fetchmany(size)
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(size)
+        finally:
+            record_fetch(time.perf_counter() - started)
+
+    def _statement(self, query):
+        return query if isinstance(query, (str, bytes)) else query.as_string(self)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """
+    Get this process's connection pool, opening min_size connections on first use
+    
+    The pool is per pid: connections must never be shared across a fork, so
+    a preloaded gunicorn master must not open it.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            pool_config = get_pool_config()
+            _pool = ThreadedConnectionPool(pool_config['min_size'], pool_config['max_size'],
+                                           **get_db_config())
+            _pool_pid = os.getpid()
+        return _pool
+
 @contextmanager
 def get_db_connection():
     """
@@ -31,16 +97,23 @@ def get_db_connection():
             # use connection
     """
     conn = None
+    pool = None
     try:
-        config = get_db_config()
-        conn = psycopg2.connect(**config)
+        pool = get_db_pool()
+        conn = pool.getconn()
         yield conn
     except psycopg2.Error as e:
         logging.error(f"Database connection error: {e}")
         raise
     finally:
         if conn is not None:
-            conn.close()
+            # Hand the connection back idle; drop it if it broke
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            pool.putconn(conn, close=bool(conn.closed))
 
 @contextmanager
 def get_db_cursor(commit=False):
@@ -52,7 +125,7 @@ def get_db_cursor(commit=False):
             # use cursor
     """
     with get_db_connection() as conn:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor = conn.cursor(cursor_factory=InstrumentedCursor)
         try:
             yield cursor
             if commit:
@@ -64,6 +137,37 @@ def get_db_cursor(commit=False):
         finally:
             cursor.close()
 
+def stream_query(sql, params=None, batch_size=1000):
+    """
+    Yield the rows of a query without loading the whole result
+
+    Uses a named (server-side) cursor, so PostgreSQL keeps the result set and
+    rows are fetched batch_size at a time; memory stays constant however many
+    rows match. The connection is held until the generator is exhausted or
+    closed.
+    
+    Usage:
+        for row in stream_query("SELECT ...", (param,)):
+            # use row
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as setup:
+            # Scoped to this transaction, so the pooled connection is unchanged
+            setup.execute('SET TRANSACTION READ ONLY')
+        cursor = conn.cursor(name=f'stream_{uuid.uuid4().hex}', cursor_factory=InstrumentedCursor)
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        except psycopg2.Error as e:
+            logging.error(f"Database error: {e}")
+            raise
+        finally:
+            cursor.close()
+
 def execute_sql_file(filename):
     """Execute SQL statements from a file"""
     try:
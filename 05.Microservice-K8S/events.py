@@ -0,0 +1,251 @@
+"""
+Events module: Order event broadcasting for Server-Sent Events
+
+Order changes are published once and fanned out to every connected
+subscriber by a single in-process broadcaster. Recent events are kept in a
+bounded ring buffer so a reconnecting client can resume from its
+Last-Event-ID. When REDIS_URL is set, events are published over Redis
+pub/sub and every replica's broadcaster relays them, so event ids are the
+same across replicas.
+
+Slow consumers never block publishers: each subscriber has a bounded queue,
+and a subscriber whose queue overflows is disconnected. Its client then
+reconnects and resumes from the ring buffer.
+"""
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+
+import metrics
+from redis_utils import get_redis
+
+ORDER_CREATED = 'order.created'
+ORDER_STATUS_CHANGED = 'order.status_changed'
+# Sent when a client's Last-Event-ID has already left the ring buffer
+STREAM_RESET = 'stream.reset'
+
+REDIS_CHANNEL = 'order-events'
+REDIS_SEQUENCE_KEY = 'order-events:seq'
+
+
+def get_events_config():
+    """Get event stream configuration from environment variables"""
+    return {
+        'buffer_size': int(os.environ.get('SSE_BUFFER_SIZE', 1000)),
+        'subscriber_queue': int(os.environ.get('SSE_SUBSCRIBER_QUEUE', 256)),
+        'heartbeat': float(os.environ.get('SSE_HEARTBEAT', 15)),
+        # Below the gunicorn worker timeout (GUNICORN_TIMEOUT, 120s)
+        'max_duration': float(os.environ.get('SSE_MAX_DURATION', 60)),
+        # Open streams per WSGI process, each holding a worker thread
+        'max_streams': int(os.environ.get('SSE_MAX_STREAMS', 4)),
+    }
+
+
+class Subscription:
+    """A single connected client's view of the event stream"""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, event):
+        """Queue an event without blocking; flag the subscriber if it is too slow"""
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+
+class AsyncSubscription:
+    """Subscriber for the ASGI mode, fed safely from publisher threads"""
+
+    def __init__(self, maxsize):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, event):
+        """Hand an event to the event loop without blocking the publisher"""
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class OrderEventBroadcaster:
+    """Fans events out to subscribers and keeps a ring buffer for resumption"""
+
+    def __init__(self, buffer_size=1000, subscriber_queue=256, redis_client=None):
+        self.subscriber_queue = subscriber_queue
+        self.redis = redis_client
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscribers = set()
+        self._next_id = 1
+        self._lock = threading.Lock()
+        if redis_client is not None:
+            threading.Thread(target=self._relay_from_redis, daemon=True,
+                             name='order-events-relay').start()
+
+    def publish(self, event_type, data):
+        """Publish an event to every subscriber (on every replica with Redis)"""
+        metrics.inc('sse_events_published_total', event=event_type)
+        if self.redis is not None:
+            event_id = self.redis.incr(REDIS_SEQUENCE_KEY)
+            self.redis.publish(REDIS_CHANNEL, json.dumps(
+                {'id': event_id, 'event': event_type, 'data': data}, default=str))
+            return
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+        self._dispatch((event_id, event_type, json.dumps(data, default=str)))
+
+    def _dispatch(self, event):
+        with self._lock:
+            self._buffer.append(event)
+            self._next_id = max(self._next_id, event[0] + 1)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.offer(event)
+
+    def _relay_from_redis(self):
+        """Feed events published by any replica into the local broadcaster"""
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REDIS_CHANNEL)
+                for message in pubsub.listen():
+                    payload = json.loads(message['data'])
+                    self._dispatch((payload['id'], payload['event'],
+                                    json.dumps(payload['data'], default=str)))
+            except Exception as e:
+                logging.error(f"Order event relay error: {e}")
+                time.sleep(1)
+
+    def subscribe(self, last_event_id=None, subscription=None):
+        """
+        Register a subscriber, pre-filled with the events it missed
+
+        If last_event_id is not covered by the ring buffer (too old, or from
+        before a restart), a stream.reset event is queued first so the
+        client knows to refetch the order list.
+        """
+        subscription = subscription or Subscription(self.subscriber_queue)
+        with self._lock:
+            if last_event_id is not None:
+                oldest = self._buffer[0][0] if self._buffer else self._next_id
+                newest = self._buffer[-1][0] if self._buffer else self._next_id - 1
+                if last_event_id < oldest - 1 or last_event_id > newest:
+                    # Gap in the buffer, or ids from before a restart
+                    subscription.offer((newest, STREAM_RESET, '{}'))
+                    last_event_id = newest
+                for event in self._buffer:
+                    if event[0] > last_event_id:
+                        subscription.offer(event)
+            self._subscribers.add(subscription)
+            metrics.set_gauge('sse_subscribers', len(self._subscribers))
+        return subscription
+
+    @property
+    def subscriber_count(self):
+        """Number of connected subscribers in this process"""
+        return len(self._subscribers)
+
+    def unsubscribe(self, subscription):
+        """Remove a subscriber"""
+        with self._lock:
+            self._subscribers.discard(subscription)
+            metrics.set_gauge('sse_subscribers', len(self._subscribers))
+
+
+def format_sse(event_id, event_type, data):
+    """Format one event in text/event-stream framing"""
+    return f'id: {event_id}\nevent: {event_type}\ndata: {data}\n\n'
+
+
+def stream_events(broadcaster, last_event_id=None, config=None):
+    """
+    Generator producing the SSE body for one client
+
+    Sends a keepalive comment every `heartbeat` seconds and ends the stream
+    after `max_duration` so long-lived connections get rebalanced; the
+    browser reconnects with Last-Event-ID and resumes without gaps.
+    """
+    config = config or get_events_config()
+    subscription = broadcaster.subscribe(last_event_id)
+    deadline = time.monotonic() + config['max_duration']
+    try:
+        yield 'retry: 3000\n\n'
+        while not subscription.overflowed and time.monotonic() < deadline:
+            try:
+                event = subscription.queue.get(timeout=config['heartbeat'])
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            yield format_sse(*event)
+        if subscription.overflowed:
+            metrics.inc('sse_slow_consumers_dropped_total')
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+async def astream_events(broadcaster, last_event_id=None, config=None):
+    """Async version of stream_events; holds no thread while the client idles"""
+    config = config or get_events_config()
+    subscription = broadcaster.subscribe(
+        last_event_id, AsyncSubscription(config['subscriber_queue']))
+    deadline = time.monotonic() + config['max_duration']
+    try:
+        yield 'retry: 3000\n\n'
+        while not subscription.overflowed and time.monotonic() < deadline:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), config['heartbeat'])
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_sse(*event)
+        if subscription.overflowed:
+            metrics.inc('sse_slow_consumers_dropped_total')
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster():
+    """Get the process-wide broadcaster (created lazily, after any fork)"""
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            config = get_events_config()
+            _broadcaster = OrderEventBroadcaster(
+                buffer_size=config['buffer_size'],
+                subscriber_queue=config['subscriber_queue'],
+                redis_client=get_redis(),
+            )
+        return _broadcaster
+
+
+def publish_order_event(event_type, order, previous_status=None):
+    """Publish an order event; failures are logged, never raised to the caller"""
+    data = {
+        'order_id': order.id,
+        'user_id': order.user_id,
+        'status': order.status,
+        'total': order.total,
+    }
+    if previous_status is not None:
+        data['previous_status'] = previous_status
+    try:
+        get_broadcaster().publish(event_type, data)
+    except Exception as e:
+        logging.error(f"Error publishing {event_type} for order {order.id}: {e}")
@@ -0,0 +1,327 @@
+"""
+Export module: Streaming bulk export of orders with their items
+
+Orders are written in order-id order as CSV (one row per order item) or
+NDJSON (one object per order with its items), optionally gzipped on the fly.
+With EXPORT_SOURCE=postgres nothing is materialised: rows come from a named
+server-side cursor, EXPORT_BATCH_SIZE at a time, and output is built one
+order at a time and handed out in chunks, so memory stays constant
+regardless of table size. The in-memory source (the default, for
+development) sorts references to the orders of the current snapshot, one
+list entry per order; the records themselves are not copied.
+
+`fields` / `include` (see fieldsets.py) choose the order columns and whether
+items are exported; without items there is one row per order. With
+PostgreSQL the projection is pushed into the query: unrequested columns are
+not selected, order_items is only joined for items, and the total is only
+summed when asked for.
+
+Chunks always end on an order boundary. An interrupted export resumes with
+`after` set to the last order id written in full; the export restarts with
+the next order.
+
+Usage:
+    python export.py --format csv --gzip -o orders.csv.gz
+    python export.py --format ndjson --after <order_id> --append -o orders.ndjson
+    python export.py --fields id,status,total
+"""
+import os
+import io
+import csv
+import sys
+import json
+import zlib
+import uuid
+import logging
+import argparse
+from decimal import Decimal
+from datetime import datetime
+
+import metrics
+from fieldsets import parse_fieldset
+
+# Exported by default: every stored order column, with items
+EXPORT_FIELDS = ('id', 'user_id', 'status', 'created_at', 'items')
+
+# Order field -> export column
+ORDER_COLUMNS = {
+    'id': 'order_id',
+    'user_id': 'user_id',
+    'status': 'status',
+    'created_at': 'created_at',
+    'total': 'total',
+}
+ITEM_COLUMNS = ['product_id', 'quantity', 'unit_price']
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Order field -> SELECT expression; o.id is always selected (grouping, resume)
+SQL_COLUMNS = {
+    'user_id': 'o.user_id::text AS user_id',
+    'status': 'o.status',
+    'created_at': 'o.created_at',
+    'total': '(SELECT COALESCE(SUM(t.quantity * t.unit_price), 0) '
+             'FROM order_items t WHERE t.order_id = o.id) AS total',
+}
+SQL_ITEM_COLUMNS = ['oi.product_id::text AS product_id', 'oi.quantity', 'oi.unit_price']
+
+
+def get_export_config():
+    """Get export configuration from environment variables"""
+    return {
+        'source': os.environ.get('EXPORT_SOURCE', 'memory'),  # memory | postgres
+        'batch_size': int(os.environ.get('EXPORT_BATCH_SIZE', 1000)),
+        'chunk_size': int(os.environ.get('EXPORT_CHUNK_SIZE', 64 * 1024)),
+    }
+
+
+def split_fieldset(fieldset):
+    """Split a fieldset into (order fields, whether items are exported)"""
+    return tuple(name for name in fieldset if name != 'items'), 'items' in fieldset
+
+
+def build_export_query(fieldset, after_placeholder=None):
+    """
+    Build the export SELECT for a fieldset
+
+    Only the requested columns are selected; order_items is joined (and
+    relies on its (order_id, id) index for an index-ordered scan) only when
+    items are exported.
+    """
+    fields, items = split_fieldset(fieldset)
+    columns = ['o.id::text AS order_id'] + [SQL_COLUMNS[name] for name in fields if name in SQL_COLUMNS]
+    sql = 'SELECT ' + ', '.join(columns + (SQL_ITEM_COLUMNS if items else [])) + '\nFROM orders o'
+    if items:
+        sql += '\nLEFT JOIN order_items oi ON oi.order_id = o.id'
+    if after_placeholder:
+        sql += f'\nWHERE o.id > {after_placeholder}::uuid'
+    return sql + ('\nORDER BY o.id, oi.id' if items else '\nORDER BY o.id')
+
+
+def parse_resume_key(after):
+    """Validate a resume key (an order UUID); None when not resuming"""
+    if not after:
+        return None
+    return str(uuid.UUID(after))
+
+
+def _order_rows(order, fields, items):
+    """Flatten an in-memory order into export rows, computing only requested fields"""
+    base = {'order_id': order.id}
+    for name in fields:
+        if name != 'id':
+            base[ORDER_COLUMNS[name]] = order.total if name == 'total' else getattr(order, name)
+    if not items:
+        yield base
+        return
+    if not order.items:
+        yield dict(base, product_id=None, quantity=None, unit_price=None)
+    for item in order.items:
+        yield dict(base, product_id=item.product_id, quantity=item.quantity,
+                   unit_price=item.unit_price)
+
+
+def _memory_orders(after):
+    """Orders after the resume key in id order (a sorted list of references)"""
+    from models import Order
+    return sorted((order for order in Order.get_all() if after is None or order.id > after),
+                  key=lambda order: order.id)
+
+
+def iter_order_rows(after=None, fieldset=EXPORT_FIELDS, config=None):
+    """Yield export rows (one per order item, or per order) for orders after the resume key"""
+    config = config or get_export_config()
+    if config['source'] == 'postgres':
+        from db_utils import stream_query
+        sql = build_export_query(fieldset, '%s' if after else None)
+        yield from stream_query(sql, (after,) if after else (), config['batch_size'])
+        return
+    fields, items = split_fieldset(fieldset)
+    for order in _memory_orders(after):
+        yield from _order_rows(order, fields, items)
+
+
+async def aiter_order_rows(after=None, fieldset=EXPORT_FIELDS, config=None):
+    """Async variant of iter_order_rows for the ASGI app"""
+    config = config or get_export_config()
+    if config['source'] == 'postgres':
+        from async_db_utils import stream_query
+        sql = build_export_query(fieldset, '$1' if after else None)
+        async for row in stream_query(sql, *((after,) if after else ()),
+                                      batch_size=config['batch_size']):
+            yield row
+        return
+    fields, items = split_fieldset(fieldset)
+    for order in _memory_orders(after):
+        for row in _order_rows(order, fields, items):
+            yield row
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class OrderExporter:
+    """
+    Incremental encoder: feed rows in order-id order, get back byte chunks
+
+    Rows of one order are held until the order is complete, then encoded;
+    encoded orders are buffered up to chunk_size before being returned.
+    `last_written` is the last order id contained in a returned chunk.
+    """
+
+    def __init__(self, fmt='csv', compress=False, header=True, chunk_size=None,
+                 fieldset=EXPORT_FIELDS):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        self.fmt = fmt
+        fields, self.items = split_fieldset(fieldset)
+        self.order_columns = [ORDER_COLUMNS[name] for name in fields]
+        self.columns = self.order_columns + (ITEM_COLUMNS if self.items else [])
+        self.chunk_size = chunk_size or get_export_config()['chunk_size']
+        self.orders = 0
+        self.last_written = None
+        self._finished = False
+        self._rows = []
+        self._buffer = io.StringIO()
+        self._buffered_last = None
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        # wbits=31: gzip container, so output is a valid .gz member
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        if header and fmt == 'csv':
+            self._writer.writerow(self.columns)
+
+    def write(self, row):
+        """Add one row; return a chunk of output or b''"""
+        if self._rows and self._rows[0]['order_id'] != row['order_id']:
+            self._encode_order()
+            if self._buffer.tell() >= self.chunk_size:
+                self._rows.append(row)
+                return self._flush()
+        self._rows.append(row)
+        return b''
+
+    def finish(self):
+        """Encode the last order and return the remaining output"""
+        if self._rows:
+            self._encode_order()
+        chunk = self._flush(final=True)
+        metrics.inc('order_exports_total', format=self.fmt)
+        return chunk
+
+    def abort(self):
+        """Close the output after the last returned chunk (drops buffered orders)"""
+        if self._compressor is None or self._finished:
+            return b''
+        self._finished = True
+        return self._compressor.flush(zlib.Z_FINISH)
+
+    def _encode_order(self):
+        rows, self._rows = self._rows, []
+        if self.fmt == 'csv':
+            for row in rows:
+                self._writer.writerow([_csv_value(row[column]) for column in self.columns])
+        else:
+            first = rows[0]
+            order = {column: _json_value(first[column]) for column in self.order_columns}
+            if self.items:
+                order['items'] = [{column: _json_value(row[column]) for column in ITEM_COLUMNS}
+                                  for row in rows if row['product_id'] is not None]
+            self._buffer.write(json.dumps(order))
+            self._buffer.write('\n')
+        self.orders += 1
+        self._buffered_last = rows[0]['order_id']
+
+    def _flush(self, final=False):
+        data = self._buffer.getvalue().encode('utf-8')
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        if self._compressor is not None:
+            # A sync flush keeps every chunk decodable on its own boundary
+            data = self._compressor.compress(data) + \
+                self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+        self.last_written = self._buffered_last
+        self._finished = final
+        return data
+
+
+def stream_export(exporter, rows):
+    """Encode rows with an exporter, yielding non-empty chunks"""
+    for row in rows:
+        chunk = exporter.write(row)
+        if chunk:
+            yield chunk
+    chunk = exporter.finish()
+    if chunk:
+        yield chunk
+
+
+async def astream_export(exporter, rows):
+    """Async variant of stream_export"""
+    async for row in rows:
+        chunk = exporter.write(row)
+        if chunk:
+            yield chunk
+    chunk = exporter.finish()
+    if chunk:
+        yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--gzip', action='store_true', help='gzip the output')
+    parser.add_argument('--after', help='resume after this order id')
+    parser.add_argument('--fields', help='comma-separated order fields (default: all but total, with items)')
+    parser.add_argument('--include', help='relations to add to --fields (items)')
+    parser.add_argument('--append', action='store_true',
+                        help='append to the output file (no CSV header)')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    args = parser.parse_args()
+
+    # The in-memory store belongs to the server process; this process's copy is empty
+    if get_export_config()['source'] != 'postgres':
+        parser.error('set EXPORT_SOURCE=postgres: the in-memory orders are only '
+                     'reachable through GET /api/orders/export')
+
+    after = parse_resume_key(args.after)
+    try:
+        fieldset = parse_fieldset('order', {'fields': args.fields, 'include': args.include},
+                                  default=EXPORT_FIELDS)
+    except ValueError as e:
+        parser.error(str(e))
+    exporter = OrderExporter(args.format, compress=args.gzip, header=not args.append,
+                             fieldset=fieldset)
+    if args.output:
+        out = open(args.output, 'ab' if args.append else 'wb')
+    else:
+        out = sys.stdout.buffer
+    try:
+        for chunk in stream_export(exporter, iter_order_rows(after, fieldset)):
+            out.write(chunk)
+    except BaseException as e:
+        out.write(exporter.abort())
+        resume = exporter.last_written or after
+        logging.error(f"Export interrupted ({e!r}); resume with --after {resume} --append")
+        raise SystemExit(1)
+    finally:
+        out.flush()
+        if args.output:
+            out.close()
+    logging.info(f"Exported {exporter.orders} orders")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,76 @@
+"""
+Fieldsets module: Sparse fieldsets for the read routes
+
+`?fields=id,status,total` limits each record in a response to the listed
+fields, and `?include=items` adds a relation on top. Only the requested
+fields are computed: an order's total and its item list are skipped unless
+asked for. Without either parameter every field is returned, as before.
+"""
+from functools import lru_cache
+from operator import attrgetter
+
+# Plain fields per resource, in response order
+FIELDS = {
+    'user': ('id', 'username', 'email', 'created_at'),
+    'product': ('id', 'name', 'description', 'price', 'stock', 'created_at'),
+    'order': ('id', 'user_id', 'status', 'created_at', 'total'),
+}
+
+# Relations that can be requested with ?include= (or listed in ?fields=)
+INCLUDES = {
+    'user': (),
+    'product': (),
+    'order': ('items',),
+}
+
+# Fields that are computed rather than read off the record
+_COMPUTED = {
+    ('order', 'total'): lambda order: order.total,
+    ('order', 'items'): lambda order: [vars(item) for item in order.items],
+}
+
+
+def _split(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def parse_fieldset(resource, args, default=None):
+    """
+    Resolve ?fields= and ?include= into the tuple of fields to serialize
+
+    `default` is used when ?fields= is absent (every field and relation
+    unless given). Raises ValueError naming any unknown field.
+    """
+    fields_arg = args.get('fields')
+    include_arg = args.get('include')
+    if fields_arg is None:
+        selected = list(default or FIELDS[resource] + INCLUDES[resource])
+    else:
+        selected = _split(fields_arg)
+    unknown = [name for name in selected if name not in FIELDS[resource] + INCLUDES[resource]]
+    if include_arg:
+        includes = _split(include_arg)
+        unknown += [name for name in includes if name not in INCLUDES[resource]]
+        selected += includes
+    if unknown:
+        raise ValueError(f"Unknown {resource} field(s): {', '.join(unknown)}")
+    if not selected:
+        raise ValueError('fields must name at least one field')
+    return tuple(dict.fromkeys(selected))
+
+
+@lru_cache(maxsize=256)
+def _getters(resource, fieldset):
+    return tuple((name, _COMPUTED.get((resource, name)) or attrgetter(name))
+                 for name in fieldset)
+
+
+def serialize(resource, record, fieldset):
+    """Build the response dict for one record with only the requested fields"""
+    return {name: getter(record) for name, getter in _getters(resource, fieldset)}
+
+
+def serialize_many(resource, records, fieldset):
+    """Build response dicts for a list of records"""
+    getters = _getters(resource, fieldset)
+    return [{name: getter(record) for name, getter in getters} for record in records]
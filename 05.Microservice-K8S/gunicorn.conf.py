@@ -0,0 +1,58 @@
+"""
+Gunicorn configuration
+
+Picks the worker class from SERVER_MODE: threaded (gthread) workers for the
+Flask (WSGI) app, uvicorn workers for the asyncio (ASGI) app. The WSGI app
+relies on threads: admission control's per-endpoint concurrency limits only
+engage when a process serves several requests at once. Other settings can still be
+overridden on the command line or with GUNICORN_CMD_ARGS.
+
+The app is preloaded in the master and warmed up (see warmup.py) before a
+worker accepts requests: fork-safe steps once in the master, connections and
+caches in each worker after the fork.
+"""
+import os
+import time
+
+# Start of the clock for startup_time_to_ready_seconds
+os.environ['APP_STARTED_AT'] = str(time.time())
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+# One worker by default: the models live in process memory, so a second
+# worker would hold its own users, products, orders and idempotency keys.
+# Only raise WEB_CONCURRENCY with a shared backend behind the models.
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# gthread workers keep checking in while requests run, so long streams
+# (SSE, exports) are not cut off; keep SSE_MAX_DURATION below this anyway.
+# A sync worker forced on the command line would be aborted mid-stream, so
+# the streaming routes refuse to run on one.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+if os.environ.get('SERVER_MODE', 'wsgi') == 'asgi':
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def when_ready(server):
+    """Run the fork-safe warmup steps in the master, shared by every worker"""
+    if preload_app:
+        import warmup
+        warmup.run_warmup(server.app.wsgi(), phases=(warmup.MASTER,))
+
+
+def post_fork(server, worker):
+    """Workers replaced after boot count their time to ready from the fork"""
+    if worker.age > server.cfg.workers:
+        import warmup
+        warmup.STARTED_AT = time.time()
+
+
+def post_worker_init(worker):
+    """Warm the worker up before it accepts its first request"""
+    # The ASGI app warms up in its before_serving hook, inside the event loop
+    if os.environ.get('SERVER_MODE', 'wsgi') != 'asgi':
+        import warmup
+        warmup.run_warmup(worker.wsgi)
@@ -0,0 +1,278 @@
+"""
+Handlers module: Request validation and response payloads for both serving modes
+
+routes.py (Flask) and asgi.py (Quart) read the request and send the
+response; everything in between (validating the body, calling the models,
+building the payload) lives here, so both modes answer the same request with
+the same status and body. Each handler takes plain values and returns a
+(payload, status, headers) tuple.
+
+Handlers call the models and, for orders, the order queue, so they block;
+asgi.py runs them off the event loop where that matters.
+"""
+from models import User, Product, Order
+from fieldsets import parse_fieldset, serialize, serialize_many
+from export import EXPORT_FIELDS, EXPORT_FORMATS, parse_resume_key
+from order_intake import enqueue_order, get_order_intake, get_intake_config
+
+VALID_ORDER_STATUSES = ['pending', 'shipped', 'delivered', 'cancelled']
+
+# Writable product fields and how each is converted from the request body
+PRODUCT_FIELDS = {
+    'name': lambda value: value,
+    'description': lambda value: value,
+    'price': float,
+    'stock': int,
+}
+
+
+def success(payload, status=200, headers=None):
+    """A successful result"""
+    return {'success': True, **payload}, status, headers or {}
+
+
+def failure(message, status, headers=None):
+    """An error result with the standard error payload"""
+    return {'success': False, 'error': message}, status, headers or {}
+
+
+def missing_field(data, fields):
+    """The error result for the first required field absent from data, else None"""
+    if not data:
+        return failure('No data provided', 400)
+    for field in fields:
+        if field not in data:
+            return failure(f'Missing required field: {field}', 400)
+    return None
+
+
+def convert_product_fields(data):
+    """Product fields present in data, converted; raises ValueError on a bad value"""
+    converted = {}
+    for key, convert in PRODUCT_FIELDS.items():
+        if key in data:
+            try:
+                converted[key] = convert(data[key])
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid value for {key}: {data[key]!r}')
+    return converted
+
+
+def order_to_dict(order):
+    """Convert an order to a dict for JSON serialization"""
+    order_dict = vars(order).copy()
+    order_dict['items'] = [vars(item) for item in order.items]
+    order_dict['total'] = order.total
+    return order_dict
+
+
+# ---------------------------
+# Users
+# ---------------------------
+def get_user(user_id, fieldset):
+    """Get a specific user by ID"""
+    user = User.get_by_id(user_id)
+    if user:
+        return success({'user': serialize('user', user, fieldset)})
+    return failure('User not found', 404)
+
+
+def create_user(data):
+    """Create a new user"""
+    error = missing_field(data, ['username', 'email'])
+    if error:
+        return error
+    user = User.create(username=data['username'], email=data['email'])
+    return success({
+        'message': 'User created successfully',
+        'user': vars(user)
+    }, 201)
+
+
+def update_user(user_id, data):
+    """Update a user's details"""
+    if not data:
+        return failure('No data provided', 400)
+    user = User.update(user_id, username=data.get('username'), email=data.get('email'))
+    if user:
+        return success({
+            'message': 'User updated successfully',
+            'user': vars(user)
+        })
+    return failure('User not found', 404)
+
+
+def delete_user(user_id):
+    """Delete a user"""
+    if User.delete(user_id):
+        return success({'message': 'User deleted successfully'})
+    return failure('User not found', 404)
+
+
+# ---------------------------
+# Products
+# ---------------------------
+def get_product(product_id, fieldset):
+    """Get a specific product by ID"""
+    product = Product.get_by_id(product_id)
+    if product:
+        return success({'product': serialize('product', product, fieldset)})
+    return failure('Product not found', 404)
+
+
+def create_product(data):
+    """Create a new product"""
+    error = missing_field(data, list(PRODUCT_FIELDS))
+    if error:
+        return error
+    try:
+        fields = convert_product_fields(data)
+    except ValueError as ve:
+        return failure(str(ve), 400)
+    product = Product.create(**fields)
+    return success({
+        'message': 'Product created successfully',
+        'product': vars(product)
+    }, 201)
+
+
+def update_product(product_id, data):
+    """Update a product's details"""
+    if not data:
+        return failure('No data provided', 400)
+    try:
+        fields = convert_product_fields(data)
+    except ValueError as ve:
+        return failure(str(ve), 400)
+    product = Product.update(product_id, **fields)
+    if product:
+        return success({
+            'message': 'Product updated successfully',
+            'product': vars(product)
+        })
+    return failure('Product not found', 404)
+
+
+def delete_product(product_id):
+    """Delete a product"""
+    if Product.delete(product_id):
+        return success({'message': 'Product deleted successfully'})
+    return failure('Product not found', 404)
+
+
+# ---------------------------
+# Orders
+# ---------------------------
+def get_user_orders(user_id, fieldset):
+    """Get all orders for a specific user"""
+    return success({'orders': serialize_many('order', Order.get_by_user(user_id), fieldset)})
+
+
+def get_order(order_id, fieldset):
+    """Get a specific order by ID, or the status of its job while it is queued"""
+    order = Order.get_by_id(order_id)
+    if order:
+        return success({'order': serialize('order', order, fieldset)})
+
+    # Orders accepted asynchronously exist only as queue jobs until processed;
+    # a done job whose order is not here is reported as not found
+    if get_intake_config()['mode'] != 'sync':
+        job = get_order_intake()[0].get(order_id)
+        if job and job['status'] != 'done':
+            return {
+                'success': job['status'] != 'dead',
+                'order_id': order_id,
+                'status': job['status'],
+                'error': job['last_error']
+            }, 202 if job['status'] != 'dead' else 422, {}
+    return failure('Order not found', 404)
+
+
+def create_order(data, async_intake=False):
+    """Create a new order, or queue it for background processing when async_intake"""
+    error = missing_field(data, ['user_id', 'items'])
+    if error:
+        return error
+
+    if not User.get_by_id(data['user_id']):
+        return failure(f"User with ID {data['user_id']} not found", 404)
+
+    if not isinstance(data['items'], list) or len(data['items']) == 0:
+        return failure('Items must be a non-empty list', 400)
+
+    for item in data['items']:
+        if not isinstance(item, dict) or 'product_id' not in item or 'quantity' not in item:
+            return failure('Each item must have product_id and quantity', 400)
+
+    if async_intake:
+        for item in data['items']:
+            if not Product.get_by_id(item['product_id']):
+                return failure(f"Product with ID {item['product_id']} not found", 400)
+
+        order_id = enqueue_order(user_id=data['user_id'], items=data['items'])
+        return success({
+            'message': 'Order accepted for processing',
+            'order_id': order_id,
+            'status': 'queued'
+        }, 202, {'Location': f'/api/orders/{order_id}'})
+
+    try:
+        order = Order.create(user_id=data['user_id'], items=data['items'])
+    except ValueError as ve:
+        return failure(str(ve), 400)
+    return success({
+        'message': 'Order created successfully',
+        'order': order_to_dict(order)
+    }, 201)
+
+
+def parse_last_event_id(headers, args):
+    """The event id an SSE client resumes after, or None; raises ValueError"""
+    last_event_id = headers.get('Last-Event-ID') or args.get('last_event_id')
+    try:
+        return int(last_event_id) if last_event_id else None
+    except ValueError:
+        raise ValueError('Last-Event-ID must be an integer')
+
+
+def parse_export_request(args):
+    """(format, resume key, fieldset) of an export request; raises ValueError"""
+    fmt = args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    try:
+        after = parse_resume_key(args.get('after'))
+    except ValueError:
+        raise ValueError('after must be an order ID')
+    return fmt, after, parse_fieldset('order', args, default=EXPORT_FIELDS)
+
+
+def export_headers(fmt, compress):
+    """Response headers of a streamed export"""
+    headers = {
+        'Content-Disposition': f'attachment; filename=orders.{fmt}',
+        'Cache-Control': 'no-store',
+        # Stop nginx (the ingress) from buffering the stream
+        'X-Accel-Buffering': 'no',
+        'Vary': 'Accept-Encoding',
+    }
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return headers
+
+
+def update_order_status(order_id, data):
+    """Update an order's status"""
+    if not data or 'status' not in data:
+        return failure('Status is required', 400)
+
+    if data['status'] not in VALID_ORDER_STATUSES:
+        return failure(f"Status must be one of: {', '.join(VALID_ORDER_STATUSES)}", 400)
+
+    order = Order.update_status(order_id, data['status'])
+    if order:
+        return success({
+            'message': 'Order status updated successfully',
+            'order': order_to_dict(order)
+        })
+    return failure('Order not found', 404)
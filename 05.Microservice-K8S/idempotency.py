@@ -0,0 +1,407 @@
+"""
+Idempotency module: Replays the first response for retried write requests
+
+Clients send an ``Idempotency-Key`` header with a write request. The first
+request with a given key runs the view and its response is stored; retries
+with the same key get the stored response back without running the view
+again. A duplicate that arrives while the original is still in flight waits
+for the original to finish instead of racing it.
+
+`idempotent` decorates Flask views; `aidempotent` decorates the Quart views
+of the ASGI mode and runs the (blocking) store calls in a thread.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+from flask import request, jsonify, current_app
+
+import metrics
+from redis_utils import get_redis
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Response headers stored with the body and sent again on replay
+STORED_HEADERS = ('Location', 'Content-Location', 'Retry-After')
+
+# Acquire results
+OWNER = 'owner'
+REPLAY = 'replay'
+CONFLICT = 'conflict'
+TIMEOUT = 'timeout'
+# The store could not be reached
+UNAVAILABLE = 'unavailable'
+
+
+class InMemoryIdempotencyStore:
+    """
+    Per-process idempotency store bounded by both TTL and entry count
+
+    Completed responses are kept in an OrderedDict in LRU order. In-flight
+    keys map to an Event that duplicates wait on.
+    """
+
+    def __init__(self, max_entries=10000, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, fingerprint, record)
+        self._inflight = {}  # key -> (fingerprint, threading.Event)
+        self._lock = threading.Lock()
+
+    def acquire(self, key, fingerprint, wait_timeout):
+        """
+        Claim a key or fetch its stored response
+
+        Returns a (state, record) tuple where state is one of OWNER,
+        REPLAY, CONFLICT or TIMEOUT. For OWNER the second item is the lease
+        to pass to hold/complete/release (None for this store).
+        """
+        deadline = time.monotonic() + wait_timeout
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] <= time.monotonic():
+                    del self._entries[key]
+                    entry = None
+                if entry:
+                    if entry[1] != fingerprint:
+                        return CONFLICT, None
+                    self._entries.move_to_end(key)
+                    return REPLAY, entry[2]
+
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    self._inflight[key] = (fingerprint, threading.Event())
+                    return OWNER, None
+                if inflight[0] != fingerprint:
+                    return CONFLICT, None
+                event = inflight[1]
+
+            metrics.inc('idempotency_waits_total')
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not event.wait(remaining):
+                return TIMEOUT, None
+
+    def hold(self, key, lease):
+        """In-flight keys never expire here, so there is nothing to keep alive"""
+        return nullcontext()
+
+    def complete(self, key, fingerprint, record, lease=None):
+        """Store the response for a key and wake any waiting duplicates"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, fingerprint, record)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.inc('idempotency_evictions_total')
+            inflight = self._inflight.pop(key, None)
+        if inflight:
+            inflight[1].set()
+
+    def release(self, key, lease=None):
+        """Give up ownership of a key without storing a response"""
+        with self._lock:
+            inflight = self._inflight.pop(key, None)
+        if inflight:
+            inflight[1].set()
+
+
+class RedisIdempotencyStore:
+    """
+    Idempotency store shared by all workers and replicas through Redis
+
+    Entries expire through Redis TTLs; the count bound is left to the
+    server's ``maxmemory-policy`` (allkeys-lru / volatile-lru). In-flight
+    keys hold a short-lived pending marker that duplicates poll on; the
+    owner keeps extending it while the view runs, and only replaces or
+    deletes it while the marker is still its own.
+    """
+
+    # Compare-and-set on the owner's pending marker (ARGV[1])
+    _EXTEND = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+               "return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0")
+    _COMPLETE = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                 "redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3]) return 1 end return 0")
+    _RELEASE = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                "return redis.call('del', KEYS[1]) end return 0")
+
+    def __init__(self, client, ttl=86400, lock_ttl=30, poll_interval=0.05, prefix='idem:'):
+        self.client = client
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self._extend = client.register_script(self._EXTEND)
+        self._complete = client.register_script(self._COMPLETE)
+        self._release = client.register_script(self._RELEASE)
+
+    def acquire(self, key, fingerprint, wait_timeout):
+        """Claim a key or fetch its stored response (see InMemoryIdempotencyStore)"""
+        redis_key = self.prefix + key
+        # The token makes the marker ours alone; it is the lease
+        pending = json.dumps({'state': 'pending', 'fingerprint': fingerprint,
+                              'token': uuid.uuid4().hex})
+        deadline = time.monotonic() + wait_timeout
+        waited = False
+        while True:
+            if self.client.set(redis_key, pending, nx=True, px=int(self.lock_ttl * 1000)):
+                return OWNER, pending
+
+            raw = self.client.get(redis_key)
+            if raw is not None:
+                entry = json.loads(raw)
+                if entry['fingerprint'] != fingerprint:
+                    return CONFLICT, None
+                if entry['state'] == 'done':
+                    return REPLAY, entry['record']
+
+            if not waited:
+                metrics.inc('idempotency_waits_total')
+                waited = True
+            if time.monotonic() >= deadline:
+                return TIMEOUT, None
+            time.sleep(self.poll_interval)
+
+    @contextmanager
+    def hold(self, key, lease):
+        """Keep extending our pending marker until the block exits"""
+        stop = threading.Event()
+        interval = self.lock_ttl / 3
+
+        def heartbeat():
+            while not stop.wait(interval):
+                try:
+                    if not self._extend(keys=[self.prefix + key],
+                                        args=[lease, int(self.lock_ttl * 1000)]):
+                        return
+                except Exception as e:
+                    logging.error(f"Error extending idempotency key {key}: {e}")
+
+        thread = threading.Thread(target=heartbeat, daemon=True, name='idempotency-heartbeat')
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+
+    def complete(self, key, fingerprint, record, lease=None):
+        """Store the response for a key, replacing our pending marker"""
+        entry = json.dumps({'state': 'done', 'fingerprint': fingerprint, 'record': record})
+        if not self._complete(keys=[self.prefix + key], args=[lease, entry, self.ttl]):
+            metrics.inc('idempotency_lost_ownership_total')
+            logging.warning(f"Idempotency key {key} was no longer ours; response not stored")
+
+    def release(self, key, lease=None):
+        """Drop our pending marker so a retry can run the request again"""
+        self._release(keys=[self.prefix + key], args=[lease])
+
+
+_store = None
+
+
+def get_idempotency_store():
+    """Get the configured idempotency store (Redis when available)"""
+    global _store
+    if _store is None:
+        ttl = int(os.environ.get('IDEMPOTENCY_TTL', 86400))
+        client = get_redis()
+        if client is not None:
+            _store = RedisIdempotencyStore(client, ttl=ttl)
+        else:
+            max_entries = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
+            _store = InMemoryIdempotencyStore(max_entries=max_entries, ttl=ttl)
+    return _store
+
+
+def _request_fingerprint(body):
+    """Hash the request body so a key reused for a different payload is rejected"""
+    return hashlib.sha256(body).hexdigest()
+
+
+def _key_error(key):
+    """Error payload for an unusable key, or None"""
+    if len(key) > MAX_KEY_LENGTH:
+        return {
+            'success': False,
+            'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'
+        }
+    return None
+
+
+def _refusal(state):
+    """(payload, status, headers) when the key is neither ours to run nor replayable, else None"""
+    if state == CONFLICT:
+        metrics.inc('idempotency_conflicts_total')
+        return {
+            'success': False,
+            'error': f'{IDEMPOTENCY_HEADER} was already used with a different request body'
+        }, 422, {}
+    if state == TIMEOUT:
+        return {
+            'success': False,
+            'error': 'A request with this idempotency key is still in progress'
+        }, 409, {}
+    if state == UNAVAILABLE:
+        # Running the request without the key could repeat it, so refuse
+        # and let the client retry with the same key
+        return {
+            'success': False,
+            'error': 'Idempotency keys are temporarily unavailable, please retry'
+        }, 503, {'Retry-After': '1'}
+    return None
+
+
+def _acquire(store, key, fingerprint):
+    """store.acquire, with store errors turned into UNAVAILABLE"""
+    try:
+        return store.acquire(key, fingerprint, _wait_timeout())
+    except Exception as e:
+        logging.error(f"Idempotency store error on {key}: {e}")
+        metrics.inc('idempotency_store_errors_total')
+        return UNAVAILABLE, None
+
+
+def _settle(operation, key, *args):
+    """Complete or release a key; a store error is logged, never raised"""
+    try:
+        operation(key, *args)
+    except Exception as e:
+        logging.error(f"Idempotency store error on {key}: {e}")
+        metrics.inc('idempotency_store_errors_total')
+
+
+def _record(status, mimetype, body, headers):
+    """The stored form of a response"""
+    return {
+        'status': status,
+        'mimetype': mimetype,
+        'body': body,
+        'headers': {name: headers[name] for name in STORED_HEADERS if name in headers},
+    }
+
+
+def _replay(response_class, record):
+    """Rebuild a stored response"""
+    metrics.inc('idempotency_hits_total')
+    response = response_class(record['body'], status=record['status'], mimetype=record['mimetype'])
+    response.headers.update(record.get('headers', {}))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait_timeout():
+    return float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', 30))
+
+
+def idempotent(view):
+    """
+    Decorator making a write endpoint honour the Idempotency-Key header
+
+    Requests without the header are passed straight through. Responses with
+    a 5xx status are not stored, so the client can retry them. If the store
+    is unreachable, keyed requests get 503 rather than run unprotected.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        error = _key_error(key)
+        if error:
+            return jsonify(error), 400
+
+        store = get_idempotency_store()
+        scoped_key = f'{request.method}:{request.path}:{key}'
+        fingerprint = _request_fingerprint(request.get_data())
+
+        state, record = _acquire(store, scoped_key, fingerprint)
+        if state == REPLAY:
+            return _replay(current_app.response_class, record)
+        refusal = _refusal(state)
+        if refusal:
+            payload, status, headers = refusal
+            return jsonify(payload), status, headers
+
+        metrics.inc('idempotency_misses_total')
+        lease = record
+        try:
+            with store.hold(scoped_key, lease):
+                response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            _settle(store.release, scoped_key, lease)
+            raise
+
+        if response.status_code >= 500:
+            _settle(store.release, scoped_key, lease)
+        else:
+            _settle(store.complete, scoped_key, fingerprint, _record(
+                response.status_code, response.mimetype,
+                response.get_data(as_text=True), response.headers), lease)
+        return response
+
+    return wrapper
+
+
+def aidempotent(view):
+    """
+    idempotent for the Quart views of the ASGI mode
+
+    Store calls (Redis round trips, or waiting for an in-flight duplicate)
+    run in a thread so they never block the event loop.
+    """
+    import quart
+
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        req = quart.request
+        key = req.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return await view(*args, **kwargs)
+        error = _key_error(key)
+        if error:
+            return quart.jsonify(error), 400
+
+        store = get_idempotency_store()
+        scoped_key = f'{req.method}:{req.path}:{key}'
+        fingerprint = _request_fingerprint(await req.get_data())
+
+        state, record = await asyncio.to_thread(_acquire, store, scoped_key, fingerprint)
+        if state == REPLAY:
+            return _replay(quart.current_app.response_class, record)
+        refusal = _refusal(state)
+        if refusal:
+            payload, status, headers = refusal
+            return quart.jsonify(payload), status, headers
+
+        metrics.inc('idempotency_misses_total')
+        lease = record
+        try:
+            with store.hold(scoped_key, lease):
+                response = await quart.current_app.make_response(await view(*args, **kwargs))
+        except Exception:
+            await asyncio.to_thread(_settle, store.release, scoped_key, lease)
+            raise
+
+        if response.status_code >= 500:
+            await asyncio.to_thread(_settle, store.release, scoped_key, lease)
+        else:
+            record = _record(response.status_code, response.mimetype,
+                             await response.get_data(as_text=True), response.headers)
+            await asyncio.to_thread(_settle, store.complete, scoped_key, fingerprint, record, lease)
+        return response
+
+    return wrapper
+
+
+metrics.register_gauge(
+    'idempotency_hit_ratio',
+    metrics.ratio('idempotency_hits_total', ['idempotency_hits_total', 'idempotency_misses_total']),
+)
@@ -1,4 +1,17 @@
-from app import app
+import os
+
+# SERVER_MODE=asgi serves the API from the asyncio (Quart) app instead of
+# the WSGI Flask app; gunicorn.conf.py picks the matching worker class.
+SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi")
+
+if SERVER_MODE == "asgi":
+    from asgi import app
+else:
+    from app import app
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    if SERVER_MODE == "asgi":
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=5000)
+    else:
+        app.run(host="0.0.0.0", port=5000, debug=True)
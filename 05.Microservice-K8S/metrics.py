@@ -0,0 +1,90 @@
+"""
+Metrics module: Lightweight in-process counters and gauges
+
+Exposed in Prometheus text format by the /metrics route so the cluster
+can scrape them without pulling in an extra client library.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_gauge_callbacks = {}
+_summaries = defaultdict(lambda: [0, 0.0])
+
+
+def _key(name, labels):
+    """Build a registry key from a metric name and its labels"""
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    """Increment a counter"""
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to an absolute value"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def register_gauge(name, callback):
+    """Register a gauge whose value is computed at scrape time"""
+    with _lock:
+        _gauge_callbacks[name] = callback
+
+
+def observe(name, value, **labels):
+    """Record an observation in a count/sum summary"""
+    with _lock:
+        summary = _summaries[_key(name, labels)]
+        summary[0] += 1
+        summary[1] += value
+
+
+def get(name, **labels):
+    """Get the current value of a counter or gauge (0 if unset)"""
+    key = _key(name, labels)
+    with _lock:
+        if key in _gauges:
+            return _gauges[key]
+        return _counters.get(key, 0)
+
+
+def ratio(numerator, denominator_names):
+    """Return a callback computing numerator / sum(denominators)"""
+    def _compute():
+        total = sum(get(name) for name in denominator_names)
+        return get(numerator) / total if total else 0.0
+    return _compute
+
+
+def _format(name, labels):
+    if not labels:
+        return name
+    rendered = ','.join(f'{k}="{v}"' for k, v in labels)
+    return f'{name}{{{rendered}}}'
+
+
+def render():
+    """Render all metrics in Prometheus text exposition format"""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        callbacks = dict(_gauge_callbacks)
+        summaries = {k: tuple(v) for k, v in _summaries.items()}
+
+    lines = []
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f'{_format(name, labels)} {value:g}')
+    for (name, labels), value in sorted(gauges.items()):
+        lines.append(f'{_format(name, labels)} {value:g}')
+    for name, callback in sorted(callbacks.items()):
+        lines.append(f'{name} {callback():g}')
+    for (name, labels), (count, total) in sorted(summaries.items()):
+        lines.append(f'{_format(name + "_count", labels)} {count:g}')
+        lines.append(f'{_format(name + "_sum", labels)} {total:g}')
+    return '\n'.join(lines) + '\n'
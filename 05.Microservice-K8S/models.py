@@ -3,16 +3,33 @@ Models module: Contains data structures used in our microservice application
 
 For the MVP, we'll use in-memory storage with these model classes
 Later, these will be converted to SQLAlchemy models
+
+The stores are lock-striped (see sharded_store) so the models are safe under
+threaded workers. Records are never mutated in place: updates store a
+modified copy, so a reader holding a record never sees a half-applied update.
+Listings go one step further: get_all returns the store's current immutable
+snapshot, shared by every reader until the next write.
 """
-from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import uuid
 
+from sharded_store import ShardedStore, Snapshot
+from cache import TwoTierCache
+from events import publish_order_event, ORDER_CREATED, ORDER_STATUS_CHANGED
+
 # In-memory data stores
-users = {}
-products = {}
-orders = {}
+users = ShardedStore()
+products = ShardedStore()
+orders = ShardedStore()
+
+# Read-through caches for the hottest lookups; writers invalidate them.
+# The per-user order lists are shared, so callers must not mutate them.
+user_cache = TwoTierCache('user')
+product_cache = TwoTierCache('product')
+order_list_cache = TwoTierCache('order_list')
 
 
 @dataclass
@@ -32,34 +49,44 @@ class User:
         return user
     
     @classmethod
-    def get_all(cls) -> List['User']:
-        """Get all users"""
-        return list(users.values())
+    def get_all(cls) -> Tuple['User', ...]:
+        """Get all users (shared and immutable)"""
+        return users.values()
+    
+    @classmethod
+    def snapshot(cls) -> Snapshot:
+        """Get the current versioned snapshot of all users"""
+        return users.snapshot()
     
     @classmethod
     def get_by_id(cls, user_id: str) -> Optional['User']:
         """Get a user by ID"""
-        return users.get(user_id)
+        return user_cache.get(user_id, users.get)
     
     @classmethod
     def update(cls, user_id: str, username: str = None, email: str = None) -> Optional['User']:
         """Update a user's details"""
-        user = cls.get_by_id(user_id)
-        if user:
-            if username:
-                user.username = username
-            if email:
-                user.email = email
-            return user
+        with users.locked(user_id):
+            # Read the store, not the cache: a cache miss can wait on another
+            # thread's load, which needs the shard lock we hold
+            user = users.get(user_id)
+            if user:
+                changes = {}
+                if username:
+                    changes['username'] = username
+                if email:
+                    changes['email'] = email
+                user = users[user_id] = replace(user, **changes)
+                user_cache.invalidate(user_id)
+                return user
         return None
     
     @classmethod
     def delete(cls, user_id: str) -> bool:
         """Delete a user by ID"""
-        if user_id in users:
-            del users[user_id]
-            return True
-        return False
+        deleted = users.pop(user_id) is not None
+        user_cache.invalidate(user_id)
+        return deleted
 
 
 @dataclass
@@ -81,33 +108,39 @@ class Product:
         return product
     
     @classmethod
-    def get_all(cls) -> List['Product']:
-        """Get all products"""
-        return list(products.values())
+    def get_all(cls) -> Tuple['Product', ...]:
+        """Get all products (shared and immutable)"""
+        return products.values()
+    
+    @classmethod
+    def snapshot(cls) -> Snapshot:
+        """Get the current versioned snapshot of all products"""
+        return products.snapshot()
     
     @classmethod
     def get_by_id(cls, product_id: str) -> Optional['Product']:
         """Get a product by ID"""
-        return products.get(product_id)
+        return product_cache.get(product_id, products.get)
     
     @classmethod
     def update(cls, product_id: str, **kwargs) -> Optional['Product']:
         """Update a product's details"""
-        product = cls.get_by_id(product_id)
-        if product:
-            for key, value in kwargs.items():
-                if hasattr(product, key):
-                    setattr(product, key, value)
-            return product
+        with products.locked(product_id):
+            # Read the store, not the cache (see User.update)
+            product = products.get(product_id)
+            if product:
+                changes = {key: value for key, value in kwargs.items() if hasattr(product, key)}
+                product = products[product_id] = replace(product, **changes)
+                product_cache.invalidate(product_id)
+                return product
         return None
     
     @classmethod
     def delete(cls, product_id: str) -> bool:
         """Delete a product by ID"""
-        if product_id in products:
-            del products[product_id]
-            return True
-        return False
+        deleted = products.pop(product_id) is not None
+        product_cache.invalidate(product_id)
+        return deleted
 
 
 @dataclass
@@ -138,37 +171,58 @@ class Order:
         return sum(item.total_price for item in self.items)
     
     @classmethod
-    def create(cls, user_id: str, items: List[Dict]) -> 'Order':
-        """Create a new order with a generated UUID"""
-        order_id = str(uuid.uuid4())
+    def create(cls, user_id: str, items: List[Dict], order_id: str = None) -> 'Order':
+        """Create a new order with a generated UUID (or one reserved at intake)"""
+        order_id = order_id or str(uuid.uuid4())
         
-        # Convert item dictionaries to OrderItem objects
-        order_items = []
+        # Lock every product in the order so the stock check and the
+        # decrement are atomic, and nothing is decremented if any item fails
+        quantities = Counter()
         for item in items:
-            product = Product.get_by_id(item['product_id'])
-            if not product:
-                raise ValueError(f"Product with ID {item['product_id']} not found")
-            
-            if item['quantity'] > product.stock:
-                raise ValueError(f"Insufficient stock for product {product.name}")
+            quantities[item['product_id']] += item['quantity']
+        
+        with products.locked(*quantities):
+            ordered = {}
+            for product_id, quantity in quantities.items():
+                # Read the store, not the cache: prices and stock must be current
+                product = products.get(product_id)
+                if not product:
+                    raise ValueError(f"Product with ID {product_id} not found")
+                
+                if quantity > product.stock:
+                    raise ValueError(f"Insufficient stock for product {product.name}")
+                ordered[product_id] = product
             
             # Update product stock
-            product.stock -= item['quantity']
-            
-            order_items.append(OrderItem(
+            for product_id, product in ordered.items():
+                products[product_id] = replace(product, stock=product.stock - quantities[product_id])
+                product_cache.invalidate(product_id)
+        
+        # Convert item dictionaries to OrderItem objects
+        order_items = [
+            OrderItem(
                 product_id=item['product_id'],
                 quantity=item['quantity'],
-                unit_price=product.price
-            ))
+                unit_price=ordered[item['product_id']].price
+            )
+            for item in items
+        ]
         
         order = cls(id=order_id, user_id=user_id, items=order_items, status='pending')
         orders[order_id] = order
+        order_list_cache.invalidate(f'user:{user_id}')
+        publish_order_event(ORDER_CREATED, order)
         return order
     
     @classmethod
-    def get_all(cls) -> List['Order']:
-        """Get all orders"""
-        return list(orders.values())
+    def get_all(cls) -> Tuple['Order', ...]:
+        """Get all orders (shared and immutable)"""
+        return orders.values()
+    
+    @classmethod
+    def snapshot(cls) -> Snapshot:
+        """Get the current versioned snapshot of all orders"""
+        return orders.snapshot()
     
     @classmethod
     def get_by_id(cls, order_id: str) -> Optional['Order']:
@@ -178,13 +232,21 @@ class Order:
     @classmethod
     def get_by_user(cls, user_id: str) -> List['Order']:
         """Get all orders for a specific user"""
-        return [order for order in orders.values() if order.user_id == user_id]
+        return order_list_cache.get(
+            f'user:{user_id}',
+            lambda _: [order for order in orders.values() if order.user_id == user_id])
     
     @classmethod
     def update_status(cls, order_id: str, status: str) -> Optional['Order']:
         """Update an order's status"""
-        order = cls.get_by_id(order_id)
+        with orders.locked(order_id):
+            order = cls.get_by_id(order_id)
+            if order:
+                previous_status = order.status
+                order = orders[order_id] = replace(order, status=status)
+                order_list_cache.invalidate(f'user:{order.user_id}')
         if order:
-            order.status = status
+            if status != previous_status:
+                publish_order_event(ORDER_STATUS_CHANGED, order, previous_status)
             return order
         return None
@@ -0,0 +1,294 @@
+"""
+Order intake module: Asynchronous order processing with background workers
+
+In async mode (ORDER_INTAKE_MODE=async, or ORDER_INTAKE_MODE=prefer and
+the client sends ``Prefer: respond-async``) POST /api/orders only validates
+the request and appends it to a durable local queue (a SQLite file), then
+returns 202 with the new order id. A pool of worker threads claims jobs in
+batches and processes each one:
+
+    create the order (status 'pending') -> run the processing steps
+    (payment, notifications, ...) -> mark it 'shipped'
+
+Failed jobs are retried with exponential backoff; jobs that fail with a
+ValueError (unknown product, insufficient stock) or that run out of
+attempts are moved to the dead-letter state.
+
+The queue file (ORDER_QUEUE_PATH) keeps the same path across restarts, so
+jobs left queued or processing by a previous process are claimed by the next
+one. The models are still in-memory, so run a single gunicorn worker: a job
+claimed by another worker would create the order where the client never
+sees it.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+
+import metrics
+from models import Order
+
+QUEUED = 'queued'
+PROCESSING = 'processing'
+DONE = 'done'
+DEAD = 'dead'
+
+# Callables run for every order between creation and shipping, e.g. payment
+# capture or notifications. Each receives the Order; raising retries the job.
+PROCESSING_STEPS = []
+
+
+def register_step(step):
+    """Register a processing step to run for every queued order"""
+    PROCESSING_STEPS.append(step)
+    return step
+
+
+def get_intake_config():
+    """Get order intake configuration from environment variables"""
+    return {
+        'mode': os.environ.get('ORDER_INTAKE_MODE', 'sync'),
+        'queue_path': os.environ.get('ORDER_QUEUE_PATH', 'order_queue.db'),
+        'workers': int(os.environ.get('ORDER_WORKERS', 2)),
+        'batch_size': int(os.environ.get('ORDER_BATCH_SIZE', 20)),
+        'max_attempts': int(os.environ.get('ORDER_MAX_ATTEMPTS', 5)),
+        'visibility_timeout': float(os.environ.get('ORDER_VISIBILITY_TIMEOUT', 300)),
+        'poll_interval': float(os.environ.get('ORDER_POLL_INTERVAL', 0.5)),
+    }
+
+
+class OrderQueue:
+    """Durable job queue stored in a SQLite database"""
+
+    def __init__(self, path, visibility_timeout=300):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS order_jobs (
+                    order_id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    claimed_at REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS order_jobs_ready ON order_jobs (status, available_at)")
+
+    def _connect(self):
+        """One connection per thread; WAL lets readers run alongside the writer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            # FULL fsyncs every commit, so enqueue is durable when it returns
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, order_id, payload):
+        """Persist a job; it is durable once this returns"""
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO order_jobs (order_id, payload, status, available_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (order_id, json.dumps(payload), QUEUED, now, now))
+        metrics.inc('order_queue_enqueued_total')
+
+    def claim_batch(self, limit):
+        """
+        Atomically claim up to `limit` ready jobs
+
+        Jobs left in 'processing' longer than the visibility timeout (their
+        worker died) are claimable again.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                "SELECT * FROM order_jobs "
+                "WHERE (status = ? AND available_at <= ?) OR (status = ? AND claimed_at <= ?) "
+                "ORDER BY available_at LIMIT ?",
+                (QUEUED, now, PROCESSING, now - self.visibility_timeout, limit)).fetchall()
+            conn.executemany(
+                "UPDATE order_jobs SET status = ?, claimed_at = ?, attempts = attempts + 1 "
+                "WHERE order_id = ?",
+                [(PROCESSING, now, row['order_id']) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [dict(row, payload=json.loads(row['payload']), attempts=row['attempts'] + 1)
+                for row in rows]
+
+    def complete(self, order_ids):
+        """Mark jobs as done"""
+        self._connect().executemany(
+            "UPDATE order_jobs SET status = ?, last_error = NULL WHERE order_id = ?",
+            [(DONE, order_id) for order_id in order_ids])
+
+    def retry(self, order_id, error, delay):
+        """Put a failed job back in the queue after a delay"""
+        self._connect().execute(
+            "UPDATE order_jobs SET status = ?, available_at = ?, last_error = ? WHERE order_id = ?",
+            (QUEUED, time.time() + delay, error, order_id))
+
+    def dead_letter(self, order_id, error):
+        """Move a job to the dead-letter state"""
+        self._connect().execute(
+            "UPDATE order_jobs SET status = ?, last_error = ? WHERE order_id = ?",
+            (DEAD, error, order_id))
+
+    def get(self, order_id):
+        """Get a job by order id, or None"""
+        row = self._connect().execute(
+            "SELECT order_id, status, attempts, last_error, created_at FROM order_jobs "
+            "WHERE order_id = ?", (order_id,)).fetchone()
+        return dict(row) if row else None
+
+    def depth(self, status=QUEUED):
+        """Number of jobs in a given status"""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM order_jobs WHERE status = ?", (status,)).fetchone()[0]
+
+
+class OrderWorkerPool:
+    """Background threads that drain the order queue in batches"""
+
+    def __init__(self, order_queue, workers=2, batch_size=20, max_attempts=5, poll_interval=0.5):
+        self.queue = order_queue
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads"""
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, daemon=True, name=f'order-worker-{index}')
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        """Wake idle workers after an enqueue"""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                jobs = self.queue.claim_batch(self.batch_size)
+            except Exception as e:
+                logging.error(f"Error claiming order jobs: {e}")
+                jobs = []
+            if not jobs:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            metrics.observe('order_worker_batch_size', len(jobs))
+            done = []
+            for job in jobs:
+                if self._process(job):
+                    done.append(job['order_id'])
+            if done:
+                self.queue.complete(done)
+
+    def _process(self, job):
+        """Process one job; returns True when it completed"""
+        order_id = job['order_id']
+        payload = job['payload']
+        try:
+            order = Order.get_by_id(order_id)
+            if order is None:
+                order = Order.create(user_id=payload['user_id'], items=payload['items'],
+                                     order_id=order_id)
+            for step in PROCESSING_STEPS:
+                step(order)
+            if order.status == 'pending':
+                Order.update_status(order_id, 'shipped')
+            metrics.inc('order_jobs_processed_total')
+            return True
+        except ValueError as ve:
+            # Business-rule failures will not succeed on retry
+            logging.warning(f"Order {order_id} rejected: {ve}")
+            self.queue.dead_letter(order_id, str(ve))
+            metrics.inc('order_jobs_dead_lettered_total')
+        except Exception as e:
+            logging.error(f"Error processing order {order_id} (attempt {job['attempts']}): {e}")
+            if job['attempts'] >= self.max_attempts:
+                self.queue.dead_letter(order_id, str(e))
+                metrics.inc('order_jobs_dead_lettered_total')
+            else:
+                self.queue.retry(order_id, str(e), delay=min(60, 2 ** job['attempts']))
+                metrics.inc('order_jobs_retried_total')
+        return False
+
+
+_intake = None
+_intake_pid = None
+_intake_lock = threading.Lock()
+
+
+def get_order_intake():
+    """
+    Get this process's (queue, worker pool) pair, starting the workers
+
+    Created lazily and per process id, so workers run in each gunicorn
+    worker rather than in a preloading master.
+    """
+    global _intake, _intake_pid
+    with _intake_lock:
+        if _intake is None or _intake_pid != os.getpid():
+            config = get_intake_config()
+            order_queue = OrderQueue(config['queue_path'],
+                                     config['visibility_timeout'])
+            pool = OrderWorkerPool(order_queue, workers=config['workers'],
+                                   batch_size=config['batch_size'],
+                                   max_attempts=config['max_attempts'],
+                                   poll_interval=config['poll_interval'])
+            pool.start()
+            _intake, _intake_pid = (order_queue, pool), os.getpid()
+        return _intake
+
+
+def enqueue_order(user_id, items):
+    """Queue an order for background processing; returns the new order id"""
+    order_queue, pool = get_order_intake()
+    order_id = str(uuid.uuid4())
+    order_queue.enqueue(order_id, {'user_id': user_id, 'items': items})
+    pool.notify()
+    return order_id
+
+
+def is_async_request(request):
+    """Whether this order request should go through the background queue"""
+    mode = get_intake_config()['mode']
+    if mode == 'async':
+        return True
+    return mode == 'prefer' and 'respond-async' in request.headers.get('Prefer', '')
+
+
+def init_order_intake(app):
+    """Start the workers on the first request when async intake is enabled"""
+    if get_intake_config()['mode'] == 'sync':
+        return
+
+    @app.before_request
+    def start_order_workers():
+        get_order_intake()
+
+    metrics.register_gauge('order_queue_depth', lambda: get_order_intake()[0].depth(QUEUED))
+    metrics.register_gauge('order_queue_in_flight', lambda: get_order_intake()[0].depth(PROCESSING))
+    metrics.register_gauge('order_queue_dead_letters', lambda: get_order_intake()[0].depth(DEAD))
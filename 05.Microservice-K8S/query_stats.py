@@ -0,0 +1,190 @@
+"""
+Query stats module: Per-request database query accounting
+
+Cursors from db_utils report every statement here. While a request is being
+served its queries are tallied in a context-local QueryStats: how many ran,
+the total time spent in the database, which were slow, and which normalized
+statement ran over and over (the N+1 pattern: one query per row of a
+previous result instead of one query for all of them).
+
+Statements are normalized before they are logged or compared: literals and
+IN lists are replaced and parameters are reduced to their types, so no
+request data ends up in logs or metric labels.
+
+Every request that touched the database feeds the db_* metrics. In debug
+mode (or with DB_STATS_HEADERS=1) the numbers are also sent back as
+X-DB-* and Server-Timing response headers. A streamed body (the export's
+server-side cursor) runs after the request hooks, so its queries are
+tallied while the stream is consumed and reported when it closes; its
+headers have been sent by then and carry no stats.
+"""
+import os
+import re
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+
+from flask import request
+
+import metrics
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*(?:%s|\?|\$\d+)\s*,?)+\)", re.IGNORECASE)
+
+_current = ContextVar('query_stats', default=None)
+
+
+def get_query_stats_config():
+    """Get query instrumentation configuration from environment variables"""
+    return {
+        'enabled': os.environ.get('DB_QUERY_STATS', '1') == '1',
+        'slow_ms': float(os.environ.get('DB_SLOW_QUERY_MS', 100)),
+        'n_plus_one_threshold': int(os.environ.get('DB_N_PLUS_ONE_THRESHOLD', 5)),
+        # Unset: follow the app's debug flag
+        'headers': os.environ.get('DB_STATS_HEADERS'),
+    }
+
+
+_config = get_query_stats_config()
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Collapse a statement to its shape: no literals, one IN (...) per list"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return ' '.join(sql.split())
+
+
+def normalize_params(params):
+    """Reduce query parameters to their types"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {name: type(value).__name__ for name, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+class QueryStats:
+    """Queries issued while serving one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = 0
+        self.statements = Counter()
+
+    def repeated(self, threshold):
+        """Normalized statements executed at least threshold times, most frequent first"""
+        return [(statement, count) for statement, count in self.statements.most_common()
+                if count >= threshold]
+
+
+def record_query(sql, params, seconds):
+    """Account for one executed statement"""
+    if not _config['enabled']:
+        return
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    statement = normalize_sql(sql)
+    metrics.inc('db_queries_total')
+    metrics.observe('db_query_seconds', seconds)
+
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += seconds
+        stats.statements[statement] += 1
+
+    if seconds * 1000 >= _config['slow_ms']:
+        metrics.inc('db_slow_queries_total')
+        if stats is not None:
+            stats.slow += 1
+        logging.warning(f"Slow query ({seconds * 1000:.1f} ms): {statement} "
+                        f"params={normalize_params(params)}")
+
+
+def record_fetch(seconds):
+    """Account for time spent fetching from a server-side cursor"""
+    if not _config['enabled']:
+        return
+    metrics.observe('db_query_seconds', seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.seconds += seconds
+
+
+def _report(stats, endpoint):
+    """Feed one request's stats into the metrics; returns the repeated statements"""
+    if stats.count == 0:
+        return []
+    metrics.observe('db_queries_per_request', stats.count, endpoint=endpoint)
+    metrics.observe('db_time_per_request_seconds', stats.seconds, endpoint=endpoint)
+
+    repeated = stats.repeated(_config['n_plus_one_threshold'])
+    for statement, count in repeated:
+        metrics.inc('db_n_plus_one_total', endpoint=endpoint)
+        logging.warning(f"Possible N+1 in {endpoint}: {count}x {statement}")
+    return repeated
+
+
+def _stream_with_stats(body, stats):
+    """Re-enter the request's stats around each chunk of a streamed body"""
+    iterator = iter(body)
+    try:
+        while True:
+            token = _current.set(stats)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+def init_query_stats(app):
+    """Collect query stats for every request; report them as metrics and debug headers"""
+    if not _config['enabled']:
+        return
+
+    @app.before_request
+    def start_query_stats():
+        _current.set(QueryStats())
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = _current.get()
+        if stats is None:
+            return response
+        endpoint = request.endpoint or 'unknown'
+        if response.is_streamed:
+            # The body runs after this hook and after teardown
+            response.response = _stream_with_stats(response.response, stats)
+            response.call_on_close(lambda: _report(stats, endpoint))
+            return response
+        if stats.count == 0:
+            return response
+        repeated = _report(stats, endpoint)
+
+        headers = _config['headers']
+        if headers == '1' or (headers is None and app.debug):
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+            response.headers['X-DB-Time-Ms'] = f'{stats.seconds * 1000:.1f}'
+            response.headers['X-DB-Slow-Queries'] = str(stats.slow)
+            response.headers.add('Server-Timing', f'db;dur={stats.seconds * 1000:.1f}')
+            if repeated:
+                statement, count = repeated[0]
+                response.headers['X-DB-N-Plus-One'] = f'{count}x {statement}'[:200]
+        return response
+
+    @app.teardown_request
+    def clear_query_stats(exc):
+        _current.set(None)
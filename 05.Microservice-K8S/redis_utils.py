@@ -0,0 +1,46 @@
+"""
+Redis utility functions for state shared across workers and replicas
+
+Redis is optional: when REDIS_URL is not set (or the redis package is not
+installed) callers fall back to their in-process implementations.
+"""
+import os
+import logging
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+_client = None
+
+
+def get_redis_config():
+    """Get Redis configuration from environment variables"""
+    return {
+        'url': os.environ.get('REDIS_URL'),
+        'socket_timeout': float(os.environ.get('REDIS_SOCKET_TIMEOUT', 2.0)),
+    }
+
+
+def get_redis():
+    """
+    Get the shared Redis client, or None when Redis is not configured
+
+    The client keeps its own connection pool, so one instance per process
+    is enough.
+    """
+    global _client
+    if _client is not None:
+        return _client
+
+    config = get_redis_config()
+    if not config['url']:
+        return None
+    if redis is None:
+        logging.warning("REDIS_URL is set but the redis package is not installed")
+        return None
+
+    _client = redis.Redis.from_url(config['url'], socket_timeout=config['socket_timeout'])
+    return _client
+
@@ -1,18 +1,84 @@
 """
 Routes for our microservice application
 """
-from flask import request, jsonify, render_template
+import hashlib
+from flask import request, jsonify, render_template, Response
 from app import app
 from models import User, Product, Order
+from idempotency import idempotent
+from fieldsets import parse_fieldset, serialize_many
+import handlers
+from events import get_broadcaster, get_events_config, stream_events
+from export import EXPORT_FORMATS, OrderExporter, iter_order_rows, stream_export
+from order_intake import is_async_request
+import metrics
 import logging
 
 # ---------------------------
 # Frontend Routes
 # ---------------------------
+# The documentation page is static, so it is rendered once per process
+_index_cache = {}
+
+
+def render_index():
+    """Render the documentation page into the per-process cache"""
+    html = render_template('index.html')
+    # One assignment, so concurrent readers never see html without its etag
+    _index_cache['page'] = (html, hashlib.sha256(html.encode('utf-8')).hexdigest()[:16])
+    return _index_cache['page']
+
+
 @app.route('/')
 def index():
     """Render the main documentation page"""
-    return render_template('index.html')
+    page = _index_cache.get('page')
+    if page is None or app.debug:
+        page = render_index()
+
+    html, etag = page
+    response = Response(html, mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def snapshot_response(snapshot, key, resource, fieldset):
+    """
+    Respond with a listing of a model snapshot
+
+    The JSON body and its ETag are built once per snapshot and fieldset, so
+    repeated listings between writes skip serialization (and, through the
+    strong ETag, compression) entirely.
+    """
+    def build():
+        body = jsonify({
+            'success': True,
+            key: serialize_many(resource, snapshot, fieldset)
+        }).get_data()
+        return body, hashlib.sha256(body).hexdigest()[:16]
+
+    body, etag = snapshot.memo((key, fieldset), build)
+    response = Response(body, mimetype=app.json.mimetype)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Expose service metrics in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain')
+
+def respond(result):
+    """Turn a handler's (payload, status, headers) into a Flask response"""
+    payload, status, headers = result
+    return jsonify(payload), status, headers
+
+
+def error_response(message, status):
+    """Build the standard error payload"""
+    return respond(handlers.failure(message, status))
+
 
 # ---------------------------
 # User Service API
@@ -21,124 +87,56 @@ def index():
 def get_users():
     """Get all users"""
     try:
-        return jsonify({
-            'success': True,
-            'users': [vars(user) for user in User.get_all()]
-        }), 200
+        fieldset = parse_fieldset('user', request.args)
+        return snapshot_response(User.snapshot(), 'users', 'user', fieldset)
+    except ValueError as ve:
+        return error_response(str(ve), 400)
     except Exception as e:
         logging.error(f"Error getting users: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/users/<user_id>', methods=['GET'])
 def get_user(user_id):
     """Get a specific user by ID"""
     try:
-        user = User.get_by_id(user_id)
-        if user:
-            return jsonify({
-                'success': True,
-                'user': vars(user)
-            }), 200
-        return jsonify({
-            'success': False,
-            'error': 'User not found'
-        }), 404
+        fieldset = parse_fieldset('user', request.args)
+        return respond(handlers.get_user(user_id, fieldset))
+    except ValueError as ve:
+        return error_response(str(ve), 400)
     except Exception as e:
         logging.error(f"Error getting user {user_id}: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/users', methods=['POST'])
 def create_user():
     """Create a new user"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'success': False,
-                'error': 'No data provided'
-            }), 400
-        
-        # Validate required fields
-        required_fields = ['username', 'email']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({
-                    'success': False,
-                    'error': f'Missing required field: {field}'
-                }), 400
-        
-        user = User.create(username=data['username'], email=data['email'])
-        return jsonify({
-            'success': True,
-            'message': 'User created successfully',
-            'user': vars(user)
-        }), 201
+        return respond(handlers.create_user(request.get_json()))
     except Exception as e:
         logging.error(f"Error creating user: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/users/<user_id>', methods=['PUT'])
 def update_user(user_id):
     """Update a user's details"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'success': False,
-                'error': 'No data provided'
-            }), 400
-        
-        user = User.update(user_id, username=data.get('username'), email=data.get('email'))
-        if user:
-            return jsonify({
-                'success': True,
-                'message': 'User updated successfully',
-                'user': vars(user)
-            }), 200
-        return jsonify({
-            'success': False,
-            'error': 'User not found'
-        }), 404
+        return respond(handlers.update_user(user_id, request.get_json()))
     except Exception as e:
         logging.error(f"Error updating user {user_id}: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/users/<user_id>', methods=['DELETE'])
 def delete_user(user_id):
     """Delete a user"""
     try:
-        success = User.delete(user_id)
-        if success:
-            return jsonify({
-                'success': True,
-                'message': 'User deleted successfully'
-            }), 200
-        return jsonify({
-            'success': False,
-            'error': 'User not found'
-        }), 404
+        return respond(handlers.delete_user(user_id))
     except Exception as e:
         logging.error(f"Error deleting user {user_id}: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 # ---------------------------
@@ -148,139 +146,56 @@ def delete_user(user_id):
 def get_products():
     """Get all products"""
     try:
-        return jsonify({
-            'success': True,
-            'products': [vars(product) for product in Product.get_all()]
-        }), 200
+        fieldset = parse_fieldset('product', request.args)
+        return snapshot_response(Product.snapshot(), 'products', 'product', fieldset)
+    except ValueError as ve:
+        return error_response(str(ve), 400)
     except Exception as e:
         logging.error(f"Error getting products: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/products/<product_id>', methods=['GET'])
 def get_product(product_id):
     """Get a specific product by ID"""
     try:
-        product = Product.get_by_id(product_id)
-        if product:
-            return jsonify({
-                'success': True,
-                'product': vars(product)
-            }), 200
-        return jsonify({
-            'success': False,
-            'error': 'Product not found'
-        }), 404
+        fieldset = parse_fieldset('product', request.args)
+        return respond(handlers.get_product(product_id, fieldset))
+    except ValueError as ve:
+        return error_response(str(ve), 400)
     except Exception as e:
         logging.error(f"Error getting product {product_id}: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/products', methods=['POST'])
 def create_product():
     """Create a new product"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'success': False,
-                'error': 'No data provided'
-            }), 400
-        
-        # Validate required fields
-        required_fields = ['name', 'description', 'price', 'stock']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({
-                    'success': False,
-                    'error': f'Missing required field: {field}'
-                }), 400
-        
-        product = Product.create(
-            name=data['name'],
-            description=data['description'],
-            price=float(data['price']),
-            stock=int(data['stock'])
-        )
-        return jsonify({
-            'success': True,
-            'message': 'Product created successfully',
-            'product': vars(product)
-        }), 201
+        return respond(handlers.create_product(request.get_json()))
     except Exception as e:
         logging.error(f"Error creating product: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/products/<product_id>', methods=['PUT'])
 def update_product(product_id):
     """Update a product's details"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'success': False,
-                'error': 'No data provided'
-            }), 400
-        
-        update_data = {}
-        if 'name' in data:
-            update_data['name'] = data['name']
-        if 'description' in data:
-            update_data['description'] = data['description']
-        if 'price' in data:
-            update_data['price'] = float(data['price'])
-        if 'stock' in data:
-            update_data['stock'] = int(data['stock'])
-        
-        product = Product.update(product_id, **update_data)
-        if product:
-            return jsonify({
-                'success': True,
-                'message': 'Product updated successfully',
-                'product': vars(product)
-            }), 200
-        return jsonify({
-            'success': False,
-            'error': 'Product not found'
-        }), 404
+        return respond(handlers.update_product(product_id, request.get_json()))
     except Exception as e:
         logging.error(f"Error updating product {product_id}: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/products/<product_id>', methods=['DELETE'])
 def delete_product(product_id):
     """Delete a product"""
     try:
-        success = Product.delete(product_id)
-        if success:
-            return jsonify({
-                'success': True,
-                'message': 'Product deleted successfully'
-            }), 200
-        return jsonify({
-            'success': False,
-            'error': 'Product not found'
-        }), 404
+        return respond(handlers.delete_product(product_id))
     except Exception as e:
         logging.error(f"Error deleting product {product_id}: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 # ---------------------------
@@ -290,163 +205,105 @@ def delete_product(product_id):
 def get_orders():
     """Get all orders"""
     try:
+        fieldset = parse_fieldset('order', request.args)
         user_id = request.args.get('user_id')
-        if user_id:
-            orders = Order.get_by_user(user_id)
-        else:
-            orders = Order.get_all()
-            
-        # Convert orders to dict for JSON serialization
-        order_list = []
-        for order in orders:
-            order_dict = vars(order).copy()
-            order_dict['items'] = [vars(item) for item in order.items]
-            order_dict['total'] = order.total
-            order_list.append(order_dict)
-            
-        return jsonify({
-            'success': True,
-            'orders': order_list
-        }), 200
+        if not user_id:
+            return snapshot_response(Order.snapshot(), 'orders', 'order', fieldset)
+        return respond(handlers.get_user_orders(user_id, fieldset))
+    except ValueError as ve:
+        return error_response(str(ve), 400)
     except Exception as e:
         logging.error(f"Error getting orders: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
+
+
+def require_threaded_worker(feature):
+    """
+    501 response for long-lived streams on a single-threaded (sync) worker
+
+    A sync worker serves nothing else while the stream is open, and gunicorn
+    aborts it after its worker timeout, losing the process's in-memory data.
+    """
+    if request.environ.get('wsgi.multithread'):
+        return None
+    return error_response(f'{feature} needs threaded (gthread) or ASGI workers', 501)
+
+
+@app.route('/api/orders/events', methods=['GET'])
+def order_events():
+    """Stream order-created and status-changed events (Server-Sent Events)"""
+    try:
+        last_event_id = handlers.parse_last_event_id(request.headers, request.args)
+    except ValueError as ve:
+        return error_response(str(ve), 400)
+
+    unsupported = require_threaded_worker('The event stream')
+    if unsupported:
+        return unsupported
+    config = get_events_config()
+    broadcaster = get_broadcaster()
+    # Leave the other worker threads to the API and the health probes
+    if broadcaster.subscriber_count >= config['max_streams']:
+        return respond(handlers.failure(
+            'Too many open event streams, please retry later', 503, {'Retry-After': '5'}))
+
+    response = Response(stream_events(broadcaster, last_event_id, config),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx (the ingress) from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/orders/export', methods=['GET'])
+def export_orders():
+    """Stream every order with its items as CSV or NDJSON (gzipped if accepted)"""
+    try:
+        fmt, after, fieldset = handlers.parse_export_request(request.args)
+    except ValueError as ve:
+        return error_response(str(ve), 400)
+
+    unsupported = require_threaded_worker('The HTTP export (or use python export.py)')
+    if unsupported:
+        return unsupported
+
+    compress = bool(request.accept_encodings['gzip'])
+    exporter = OrderExporter(fmt, compress=compress, header=after is None,
+                             fieldset=fieldset)
+    return Response(stream_export(exporter, iter_order_rows(after, fieldset)),
+                    mimetype=EXPORT_FORMATS[fmt],
+                    headers=handlers.export_headers(fmt, compress))
 
 
 @app.route('/api/orders/<order_id>', methods=['GET'])
 def get_order(order_id):
     """Get a specific order by ID"""
     try:
-        order = Order.get_by_id(order_id)
-        if order:
-            order_dict = vars(order).copy()
-            order_dict['items'] = [vars(item) for item in order.items]
-            order_dict['total'] = order.total
-            
-            return jsonify({
-                'success': True,
-                'order': order_dict
-            }), 200
-        return jsonify({
-            'success': False,
-            'error': 'Order not found'
-        }), 404
+        fieldset = parse_fieldset('order', request.args)
+        return respond(handlers.get_order(order_id, fieldset))
+    except ValueError as ve:
+        return error_response(str(ve), 400)
     except Exception as e:
         logging.error(f"Error getting order {order_id}: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/orders', methods=['POST'])
+@idempotent
 def create_order():
-    """Create a new order"""
+    """Create a new order (retries with the same Idempotency-Key are replayed)"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'success': False,
-                'error': 'No data provided'
-            }), 400
-        
-        # Validate required fields
-        required_fields = ['user_id', 'items']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({
-                    'success': False,
-                    'error': f'Missing required field: {field}'
-                }), 400
-        
-        # Validate user exists
-        user = User.get_by_id(data['user_id'])
-        if not user:
-            return jsonify({
-                'success': False,
-                'error': f"User with ID {data['user_id']} not found"
-            }), 404
-        
-        # Validate items format
-        if not isinstance(data['items'], list) or len(data['items']) == 0:
-            return jsonify({
-                'success': False,
-                'error': 'Items must be a non-empty list'
-            }), 400
-        
-        for item in data['items']:
-            if 'product_id' not in item or 'quantity' not in item:
-                return jsonify({
-                    'success': False,
-                    'error': 'Each item must have product_id and quantity'
-                }), 400
-        
-        try:
-            order = Order.create(user_id=data['user_id'], items=data['items'])
-            
-            # Prepare response
-            order_dict = vars(order).copy()
-            order_dict['items'] = [vars(item) for item in order.items]
-            order_dict['total'] = order.total
-            
-            return jsonify({
-                'success': True,
-                'message': 'Order created successfully',
-                'order': order_dict
-            }), 201
-        except ValueError as ve:
-            return jsonify({
-                'success': False,
-                'error': str(ve)
-            }), 400
+        return respond(handlers.create_order(request.get_json(), is_async_request(request)))
     except Exception as e:
         logging.error(f"Error creating order: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
 
 
 @app.route('/api/orders/<order_id>/status', methods=['PUT'])
 def update_order_status(order_id):
     """Update an order's status"""
     try:
-        data = request.get_json()
-        if not data or 'status' not in data:
-            return jsonify({
-                'success': False,
-                'error': 'Status is required'
-            }), 400
-        
-        # Validate status value
-        valid_statuses = ['pending', 'shipped', 'delivered', 'cancelled']
-        if data['status'] not in valid_statuses:
-            return jsonify({
-                'success': False,
-                'error': f"Status must be one of: {', '.join(valid_statuses)}"
-            }), 400
-        
-        order = Order.update_status(order_id, data['status'])
-        if order:
-            order_dict = vars(order).copy()
-            order_dict['items'] = [vars(item) for item in order.items]
-            order_dict['total'] = order.total
-            
-            return jsonify({
-                'success': True,
-                'message': 'Order status updated successfully',
-                'order': order_dict
-            }), 200
-        return jsonify({
-            'success': False,
-            'error': 'Order not found'
-        }), 404
+        return respond(handlers.update_order_status(order_id, request.get_json()))
     except Exception as e:
         logging.error(f"Error updating order status for {order_id}: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(str(e), 500)
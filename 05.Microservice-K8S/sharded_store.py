@@ -0,0 +1,204 @@
+"""
+Sharded store: lock-striped in-memory key/value store
+
+Keys are spread over N partitions by hash, each guarded by its own lock,
+so threads working on different records rarely contend. Single-key
+operations touch exactly one shard; operations spanning several keys lock
+the shards they need in a fixed order to avoid deadlocks.
+
+Listings read an immutable, versioned Snapshot instead of copying the store.
+A writer republishes its own shard as a tuple under that shard's lock; a
+reader takes no lock and only concatenates the published tuples. A
+single-key write swaps one tuple, which a reader sees whole or not at all.
+Multi-key updates (locked()) mark their shards as in progress, and a reader
+retries if it overlapped one, so a snapshot never shows half of an update.
+A reader that keeps overlapping them returns the last consistent snapshot
+rather than wait; if there is none yet, it takes the shard locks once and
+builds one. Until the next write every reader shares one snapshot and
+whatever was derived from it.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from itertools import chain
+
+import metrics
+
+# Derived values (e.g. serialized responses) kept per snapshot
+SNAPSHOT_MEMO_SIZE = 32
+# Attempts at a consistent cut before settling for the previous snapshot
+SNAPSHOT_ATTEMPTS = 3
+
+
+class Snapshot:
+    """Immutable view of a store at one version"""
+
+    __slots__ = ('version', 'values', '_memo')
+
+    def __init__(self, version, values):
+        self.version = version
+        self.values = values
+        self._memo = {}
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def memo(self, key, build):
+        """Compute a value derived from this snapshot once and share it"""
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = build()
+            if len(self._memo) < SNAPSHOT_MEMO_SIZE:
+                self._memo[key] = value
+            return value
+
+
+class ShardedStore:
+    """Dict-like store partitioned into independently locked shards"""
+
+    def __init__(self, shards=None):
+        shards = shards or int(os.environ.get('STORE_SHARDS', 16))
+        self._shards = [{} for _ in range(shards)]
+        self._locks = [threading.RLock() for _ in range(shards)]
+        # Per shard, changed only under its lock: values published as a
+        # tuple, a version bumped on every write, and the multi-key updates
+        # in progress and finished
+        self._shard_values = [()] * shards
+        self._versions = [0] * shards
+        self._active = [0] * shards
+        self._finished = [0] * shards
+        # A snapshot's version is the sum of the shard versions; None until
+        # the first one is built
+        self._snapshot = None
+
+    def _index(self, key):
+        return hash(key) % len(self._shards)
+
+    def _publish(self, index):
+        """Republish a shard after a write; caller holds its lock"""
+        self._shard_values[index] = tuple(self._shards[index].values())
+        self._versions[index] += 1
+
+    def __getitem__(self, key):
+        index = self._index(key)
+        with self._locks[index]:
+            return self._shards[index][key]
+
+    def get(self, key, default=None):
+        """Get a value by key (one shard lock)"""
+        index = self._index(key)
+        with self._locks[index]:
+            return self._shards[index].get(key, default)
+
+    def __setitem__(self, key, value):
+        index = self._index(key)
+        with self._locks[index]:
+            self._shards[index][key] = value
+            self._publish(index)
+
+    def __delitem__(self, key):
+        index = self._index(key)
+        with self._locks[index]:
+            del self._shards[index][key]
+            self._publish(index)
+
+    def pop(self, key, default=None):
+        """Remove a key and return its value, or default"""
+        index = self._index(key)
+        with self._locks[index]:
+            shard = self._shards[index]
+            if key not in shard:
+                return default
+            value = shard.pop(key)
+            self._publish(index)
+            return value
+
+    def __contains__(self, key):
+        index = self._index(key)
+        with self._locks[index]:
+            return key in self._shards[index]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    @contextmanager
+    def locked(self, *keys):
+        """
+        Hold the shard locks for the given keys
+
+        Use for read-modify-write sequences; locks are taken in shard order
+        so concurrent multi-key operations cannot deadlock. The locks are
+        re-entrant, so get/set inside the block are safe. Snapshots taken
+        while the block runs do not include its partial writes.
+        """
+        indexes = sorted({self._index(key) for key in keys})
+        for index in indexes:
+            self._locks[index].acquire()
+            self._active[index] += 1
+        try:
+            yield self
+        finally:
+            for index in reversed(indexes):
+                self._finished[index] += 1
+                self._active[index] -= 1
+                self._locks[index].release()
+
+    def snapshot(self):
+        """
+        Current immutable snapshot of every value, without taking any lock
+
+        The same Snapshot is returned until the next write. A reader that
+        overlaps multi-key updates on every attempt gets the previous
+        snapshot, which is consistent but may miss those writes. If no
+        snapshot was built yet, it waits for the shard locks and builds one.
+        """
+        snapshot = self._snapshot
+        if (snapshot is not None and snapshot.version == sum(self._versions)
+                and not any(self._active)):
+            return snapshot
+        for attempt in range(SNAPSHOT_ATTEMPTS):
+            if attempt:
+                time.sleep(0)  # let the writer finish
+            # Versions before values: the values are at least this recent
+            versions = list(self._versions)
+            finished = list(self._finished)
+            if any(self._active):
+                continue
+            values = tuple(chain.from_iterable(self._shard_values))
+            # No multi-key update started or finished while we read the shards
+            if not any(self._active) and self._finished == finished:
+                snapshot = self._snapshot = Snapshot(sum(versions), values)
+                return snapshot
+        if self._snapshot is None:
+            return self._locked_snapshot()
+        metrics.inc('store_snapshot_stale_total')
+        return self._snapshot
+
+    def _locked_snapshot(self):
+        """Build a snapshot holding every shard lock (taken in shard order)"""
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            snapshot = self._snapshot = Snapshot(
+                sum(self._versions), tuple(chain.from_iterable(self._shard_values)))
+            return snapshot
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+    def values(self):
+        """All values, as a tuple shared by every reader of the current snapshot"""
+        return self.snapshot().values
+
+    def clear(self):
+        """Remove every key"""
+        for index, lock in enumerate(self._locks):
+            with lock:
+                if self._shards[index]:
+                    self._shards[index].clear()
+                    self._publish(index)
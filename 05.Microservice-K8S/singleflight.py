@@ -0,0 +1,62 @@
+"""
+Single-flight module: Coalesces concurrent calls for the same key
+
+When many threads ask for the same missing key at once, only the first one
+runs the load; the others wait for it and share its result (or its
+exception).
+"""
+import threading
+
+import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Per-key call coalescing across the threads of one process"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run fn() for key, or wait for the call already in flight for it
+
+        Waiters block until the leader's fn() returns, so never call this
+        while holding a lock that fn() may need (e.g. a store shard lock).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.inc('singleflight_coalesced_total', cache=self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key):
+        """Whether a call for key is currently running"""
+        with self._lock:
+            return key in self._calls
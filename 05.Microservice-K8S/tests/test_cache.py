@@ -0,0 +1,85 @@
+"""
+Invalidation tests for the two-tier lookup cache (local tier only)
+"""
+import threading
+import time
+
+from cache import TwoTierCache
+
+CONFIG = {
+    'enabled': True,
+    'max_entries': 100,
+    'ttl': 60,
+    'stale_ttl': 0,
+    'redis_ttl': 60,
+    'shared_tier': False,
+    'lock_ttl': 1.0,
+}
+
+
+def _cache(name):
+    return TwoTierCache(f'test-{name}', config=CONFIG)
+
+
+def test_invalidate_drops_the_cached_value():
+    cache = _cache('invalidate')
+    backing = {'k': 'old'}
+    loads = []
+
+    def loader(key):
+        loads.append(key)
+        return backing[key]
+
+    assert cache.get('k', loader) == 'old'
+    assert cache.get('k', loader) == 'old'
+    backing['k'] = 'new'
+    cache.invalidate('k')
+
+    assert cache.get('k', loader) == 'new'
+    assert len(loads) == 2
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    cache = _cache('racing-load')
+    backing = {'k': 'old'}
+    loading = threading.Event()
+
+    def slow_loader(key):
+        value = backing[key]
+        loading.set()
+        time.sleep(0.2)
+        return value
+
+    reader = threading.Thread(target=cache.get, args=('k', slow_loader), daemon=True)
+    reader.start()
+    loading.wait()
+    backing['k'] = 'new'
+    cache.invalidate('k')
+    reader.join()
+
+    assert cache.get('k', lambda key: backing[key]) == 'new'
+
+
+def test_read_after_invalidate_does_not_join_an_older_load():
+    cache = _cache('single-flight')
+    backing = {'k': 'old'}
+    loading = threading.Event()
+    results = []
+
+    def slow_loader(key):
+        value = backing[key]
+        loading.set()
+        time.sleep(0.2)
+        return value
+
+    reader = threading.Thread(target=lambda: results.append(cache.get('k', slow_loader)),
+                              daemon=True)
+    reader.start()
+    loading.wait()
+    backing['k'] = 'new'
+    cache.invalidate('k')
+
+    # The first load is still in flight; a read started now must not share it
+    assert cache.get('k', slow_loader) == 'new'
+    reader.join()
+    assert results == ['old']
@@ -0,0 +1,79 @@
+"""
+Tests for Idempotency-Key handling on POST endpoints
+"""
+import uuid
+
+from flask import Flask, jsonify
+
+import idempotency
+from idempotency import idempotent
+from models import Order, Product, User
+from app import app
+
+
+def _order_body():
+    user = User.create(username='buyer', email='buyer@example.com')
+    product = Product.create(name='p', description='d', price=2.0, stock=10)
+    return {'user_id': user.id, 'items': [{'product_id': product.id, 'quantity': 1}]}
+
+
+def test_retry_replays_the_first_response():
+    client = app.test_client()
+    body = _order_body()
+    headers = {'Idempotency-Key': str(uuid.uuid4())}
+
+    first = client.post('/api/orders', json=body, headers=headers)
+    retry = client.post('/api/orders', json=body, headers=headers)
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    assert len(Order.get_by_user(body['user_id'])) == 1
+
+
+def test_key_reused_with_another_body_conflicts():
+    client = app.test_client()
+    body = _order_body()
+    headers = {'Idempotency-Key': str(uuid.uuid4())}
+
+    assert client.post('/api/orders', json=body, headers=headers).status_code == 201
+    other = dict(body, items=[dict(body['items'][0], quantity=2)])
+    response = client.post('/api/orders', json=other, headers=headers)
+
+    assert response.status_code == 422
+    assert len(Order.get_by_user(body['user_id'])) == 1
+
+
+def test_replay_keeps_the_location_header():
+    accepting = Flask(__name__)
+
+    @accepting.route('/jobs', methods=['POST'])
+    @idempotent
+    def accept():
+        return jsonify({'success': True}), 202, {'Location': '/jobs/1'}
+
+    client = accepting.test_client()
+    headers = {'Idempotency-Key': str(uuid.uuid4())}
+    client.post('/jobs', json={}, headers=headers)
+    retry = client.post('/jobs', json={}, headers=headers)
+
+    assert retry.status_code == 202
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.headers['Location'] == '/jobs/1'
+
+
+def test_store_error_refuses_keyed_requests(monkeypatch):
+    class UnreachableStore:
+        def acquire(self, key, fingerprint, timeout):
+            raise ConnectionError('store down')
+
+    monkeypatch.setattr(idempotency, '_store', UnreachableStore())
+    client = app.test_client()
+    body = _order_body()
+
+    response = client.post('/api/orders', json=body,
+                           headers={'Idempotency-Key': str(uuid.uuid4())})
+
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    assert Order.get_by_user(body['user_id']) == []
@@ -0,0 +1,57 @@
+"""
+Threaded regression tests for the models layer
+"""
+import threading
+import time
+
+from models import User, Product
+
+DURATION = 1.0
+JOIN_TIMEOUT = 10
+
+
+def _hammer(readers, writers):
+    """Run reader and writer loops for DURATION; return the threads still stuck"""
+    deadline = time.monotonic() + DURATION
+    errors = []
+
+    def loop(fn):
+        try:
+            while time.monotonic() < deadline:
+                fn()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=loop, args=(fn,), daemon=True)
+               for fn in readers + writers]
+    for thread in threads:
+        thread.start()
+    join_deadline = deadline + JOIN_TIMEOUT
+    for thread in threads:
+        thread.join(max(0, join_deadline - time.monotonic()))
+    assert not errors
+    return [thread for thread in threads if thread.is_alive()]
+
+
+def test_product_update_does_not_deadlock_with_reads():
+    product = Product.create(name='p', description='d', price=1.0, stock=10)
+    counter = iter(range(10 ** 9))
+
+    stuck = _hammer(
+        readers=[lambda: Product.get_by_id(product.id)] * 4,
+        writers=[lambda: Product.update(product.id, stock=next(counter))] * 2,
+    )
+    assert not stuck
+    assert Product.get_by_id(product.id) is not None
+
+
+def test_user_update_does_not_deadlock_with_reads():
+    user = User.create(username='u', email='u@example.com')
+    counter = iter(range(10 ** 9))
+
+    stuck = _hammer(
+        readers=[lambda: User.get_by_id(user.id)] * 4,
+        writers=[lambda: User.update(user.id, username=f'u{next(counter)}')] * 2,
+    )
+    assert not stuck
+    assert User.get_by_id(user.id) is not None
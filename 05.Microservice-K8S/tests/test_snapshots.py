@@ -0,0 +1,50 @@
+"""
+Consistency tests for the store snapshots behind the listings
+"""
+import threading
+
+from models import Product, Order, User
+from sharded_store import ShardedStore
+from test_models_concurrency import _hammer
+
+
+def test_snapshot_never_shows_half_an_order():
+    user = User.create(username='buyer', email='buyer@example.com')
+    first = Product.create(name='a', description='d', price=1.0, stock=10 ** 6)
+    second = Product.create(name='b', description='d', price=1.0, stock=10 ** 6)
+    items = [{'product_id': first.id, 'quantity': 1}, {'product_id': second.id, 'quantity': 1}]
+    torn = []
+
+    def read():
+        stock = {product.id: product.stock for product in Product.snapshot()}
+        if stock[first.id] != stock[second.id]:
+            torn.append(stock)
+
+    stuck = _hammer(
+        readers=[read] * 4,
+        writers=[lambda: Order.create(user_id=user.id, items=items)] * 2,
+    )
+    assert not stuck
+    assert not torn
+
+
+def test_first_snapshot_waits_for_a_multi_key_update():
+    store = ShardedStore(shards=4)
+    store['a'], store['b'] = 1, 1
+    started, finish = threading.Event(), threading.Event()
+
+    def update():
+        with store.locked('a', 'b'):
+            store['a'] = 2
+            started.set()
+            finish.wait()
+            store['b'] = 2
+
+    writer = threading.Thread(target=update, daemon=True)
+    writer.start()
+    started.wait()
+    # Every lock-free attempt overlaps the update and there is no earlier
+    # snapshot to fall back on, so the reader waits for the shard locks
+    threading.Timer(0.1, finish.set).start()
+    assert sorted(store.snapshot().values) == [2, 2]
+    writer.join()
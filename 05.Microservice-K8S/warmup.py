@@ -0,0 +1,144 @@
+"""
+Warmup module: Startup work done before a process takes traffic
+
+Steps run in two phases. 'master' steps are fork-safe (imports, rendering
+templates) and run once in the gunicorn master when the app is preloaded,
+so every worker inherits their results copy-on-write. 'worker' steps open
+connections and fill caches, which must happen per process after the fork;
+gunicorn runs them before the worker accepts its first request.
+
+/healthz reports the process is alive; /readyz returns 503 until every step
+has run. A failing step is logged and counted but does not block readiness,
+so an optional dependency being down cannot keep the pod out of service.
+Time from process start to ready is exported as startup_time_to_ready_seconds.
+"""
+import os
+import time
+import logging
+import importlib
+import threading
+
+from flask import Flask, jsonify
+
+import metrics
+
+MASTER = 'master'
+WORKER = 'worker'
+
+# (name, phase, callable(app)) in run order
+WARMUP_STEPS = []
+
+# Heavy modules the request path would otherwise import on first use
+LAZY_MODULES = ['psycopg2.extras', 'psycopg2.pool', 'db_utils']
+
+# Set by gunicorn.conf.py in the master, inherited by the workers
+STARTED_AT = float(os.environ.get('APP_STARTED_AT', time.time()))
+
+_done = set()
+_ready = threading.Event()
+_run_lock = threading.Lock()
+
+
+def register_step(name, phase=WORKER):
+    """Register a warmup step to run before the process reports ready"""
+    def decorator(step):
+        WARMUP_STEPS.append((name, phase, step))
+        return step
+    return decorator
+
+
+def get_warmup_config():
+    """Get warmup configuration from environment variables"""
+    return {
+        'enabled': os.environ.get('WARMUP_ENABLED', '1') == '1',
+        'max_products': int(os.environ.get('WARMUP_MAX_PRODUCTS', 1000)),
+    }
+
+
+def run_warmup(app, phases=(MASTER, WORKER)):
+    """Run the steps of the given phases that have not run in this process yet"""
+    with _run_lock:
+        if get_warmup_config()['enabled']:
+            for name, phase, step in WARMUP_STEPS:
+                if phase not in phases or name in _done:
+                    continue
+                started = time.perf_counter()
+                try:
+                    step(app)
+                except Exception as e:
+                    logging.error(f"Warmup step {name} failed: {e}")
+                    metrics.inc('startup_warmup_failures_total', step=name)
+                metrics.set_gauge('startup_step_seconds', time.perf_counter() - started, step=name)
+                _done.add(name)
+        if WORKER in phases and not _ready.is_set():
+            time_to_ready = time.time() - STARTED_AT
+            metrics.set_gauge('startup_time_to_ready_seconds', time_to_ready)
+            logging.info(f"Process {os.getpid()} ready after {time_to_ready:.2f}s")
+            _ready.set()
+
+
+def is_ready():
+    """Whether this process has finished warming up"""
+    return _ready.is_set()
+
+
+@register_step('import_modules', phase=MASTER)
+def _import_modules(app):
+    for module in LAZY_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logging.warning(f"Warmup: cannot import {module}: {e}")
+
+
+@register_step('render_index', phase=MASTER)
+def _render_index(app):
+    if not isinstance(app, Flask):
+        return  # the ASGI app renders its page per request
+    from routes import render_index
+    # The template builds URLs, which needs a request context
+    with app.test_request_context('/'):
+        render_index()
+
+
+@register_step('open_connections')
+def _open_connections(app):
+    from redis_utils import get_redis
+    client = get_redis()
+    if client is not None:
+        client.ping()
+    if os.environ.get('PGHOST'):
+        from db_utils import get_db_pool
+        get_db_pool()
+
+
+@register_step('warm_caches')
+def _warm_caches(app):
+    from models import User, Product
+    User.get_all()
+    for product in Product.get_all()[:get_warmup_config()['max_products']]:
+        Product.get_by_id(product.id)
+
+
+def init_warmup(app):
+    """Register the health endpoints; warm up on the first request if nothing else did"""
+
+    @app.route('/healthz')
+    def healthz():
+        """Liveness: the process is up and serving requests"""
+        return jsonify({'status': 'ok'}), 200
+
+    @app.route('/readyz')
+    def readyz():
+        """Readiness: warmup has finished in this process"""
+        if not is_ready():
+            return jsonify({'status': 'warming up'}), 503
+        return jsonify({'status': 'ready'}), 200
+
+    # Under gunicorn the hooks in gunicorn.conf.py have already run warmup;
+    # the development server warms up in the background on first contact
+    @app.before_request
+    def start_warmup():
+        if not is_ready() and not _run_lock.locked():
+            threading.Thread(target=run_warmup, args=(app,), daemon=True,
+                             name='warmup').start()